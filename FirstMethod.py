@@ -1,28 +1,74 @@
 import cohere
 import pandas as pd
 import sys
-import csv
 import os
 import time
-import re
 
-# Cohere klijent
-co = cohere.ClientV2("cohere key value")
+from triplet_parser import parse_response, has_pronoun_in_SO
+from few_shot import examples_block, compare_prompts
+from llm_client import Hedger, TieredLLM
+from triplet_repair import repair_triplets
+from triplet_sink import open_sinks
+from triplet_writer import GroupCommitWriter, journal_path, recover_outputs
 
-# --- Skup zamjenica (lowercase) ---
-PRONOUNS = {
-    "i","me","myself","my","mine",
-    "he","him","himself","his",
-    "she","her","herself","hers",
-    "it","itself","its",
-    "they","them","themselves","themself","their","theirs",
-    "who","whom","whose"
+# ======= CONFIG =======
+co = cohere.ClientV2("cohere key value")
+MODEL_TIERS = {
+    "base": "command-r7b-12-2024",    # 1. prolaz (većina chunkova): manji i brži model
+    "context": "command-a-03-2025",   # prolazi sa kontekstom / rewrite
+    "escalate": "command-a-03-2025",  # ponovi prolaz kad izlaz nije validan (None = bez eskalacije)
 }
-
-WORD_RE = re.compile(r"\b[\w&'’-]+\b", flags=re.UNICODE)  # tokenizacija sa granicama riječi
-
-def generate_text(text):
-    prompt = f"""Extract only factual triplets from the following text in the format: "Subject"|"Relation"|"Object".
+HEDGE = True                # duplikat poziva kad odgovor kasni preko percentila nedavnih latencija
+HEDGE_PERCENTILE = 0.95
+HEDGE_MAX_RATE = 0.05       # max udio poziva koji dobiju hedge
+HEDGE_MIN_SAMPLES = 20      # bez hedge-a dok nema dovoljno izmjerenih latencija (po modelu)
+REPAIR = True               # linije koje krše pravila prompta šalju se nazad kratkim fix-up promptom
+REPAIR_MAX_ROUNDS = 2       # max fix-up poziva po odgovoru
+REPAIR_MAX_LINES = 20       # max linija po fix-up promptu
+
+INPUT_CSV = "paragraph_chunks2.csv"
+OUTPUT_CSV = "triplets_with_index_chunks.csv"
+BAD_DIR = "bad_form_triplets_chunks"
+BAD_CSV = os.path.join(BAD_DIR, "bad_triplets_chunks.csv")
+
+OUTPUT_FORMAT = "csv"     # "csv" | "parquet" | "both" (parquet traži pyarrow)
+PARQUET_DIR = "triplets_m1_parquet"  # <dir>/good i <dir>/bad dataseti
+DEDUP = True              # ne upisuj isti (normalizovan) triplet dva puta za isti question_ID
+DEDUP_MAX_QUESTIONS = 256 # koliko aktivnih question_ID-a se pamti (LRU)
+DEDUP_MAX_KEYS = 10_000   # max ključeva po question_ID-u
+WRITER_FLUSH_ROWS = 500   # commit (flush + fsync + journal) nakon ovoliko redova...
+WRITER_FLUSH_SECONDS = 2.0 # ...ili nakon ovoliko sekundi
+
+START_CHUNK_ID = 126083
+K_PREV = 2                # koliko prethodnih chunkova ide u rewrite kontekst
+
+FEW_SHOT_MODE = "full"          # "full" | "adaptive" | "compare" (mjerenje: oba prompta, u izlaz ide full)
+FEW_SHOT_MAX = 2                # adaptive: max broj primjera po promptu
+FEW_SHOT_TOKEN_BUDGET = 250     # adaptive: max (procijenjenih) tokena za primjere
+FEW_SHOT_STATS_CSV = "few_shot_stats_m1.csv"
+
+def few_shot_examples(text: str, few_shot: str = None) -> str:
+    return examples_block(text, few_shot or FEW_SHOT_MODE, FEW_SHOT_MAX, FEW_SHOT_TOKEN_BUDGET)
+
+def repair_lines(parsed):
+    """Popravka samo linija koje krše pravila (jeftin "base" model, bez eskalacije)."""
+    parsed, stats = repair_triplets(parsed, lambda p: call_llm(p, "base", escalate=False),
+                                    REPAIR_MAX_ROUNDS, REPAIR_MAX_LINES)
+    if stats["offending"]:
+        print(f"🔧 Repaired {stats['repaired']}/{stats['offending']} line(s) in {stats['calls']} call(s)")
+    return parsed
+
+# popravka ide prije eskalacije: skupi model se zove tek kad popravka ne spasi nijednu liniju
+llm = TieredLLM(MODEL_TIERS, Hedger(HEDGE_PERCENTILE, HEDGE_MAX_RATE, HEDGE_MIN_SAMPLES) if HEDGE else None,
+                repair_lines if REPAIR else None)
+
+def call_llm(prompt: str, tier: str = "base", escalate: bool = True,
+             pronoun_fallback: bool = False) -> str:
+    return llm.call(co, prompt, tier, escalate=escalate, pronoun_fallback=pronoun_fallback)
+
+def build_extraction_prompt(text, few_shot=None):
+    examples = few_shot_examples(text, few_shot)
+    return f"""Extract only factual triplets from the following text in the format: "Subject"|"Relation"|"Object".
 STRICT RULES:
 - Each line MUST contain exactly 3 parts: subject, relation, object.
 - Subject and object MUST each be 1–5 words (no long descriptions, no clauses).
@@ -30,64 +76,18 @@ STRICT RULES:
 - DO NOT include explanations, reasons, comparisons, or long sentences.
 - If you cannot extract a valid triplet under these rules, skip it (do not generate).
 - Output only valid triplets, one per sentence.
-Example 1:
-Input: Albert Einstein developed the theory of relativity while working in Switzerland.
-Outputs:
-"Albert Einstein"|"developed"|"theory of relativity"
-"Albert Einstein"|"worked in"|"Switzerland"
-
-Example 2:
-Input: The Eiffel Tower in Paris was designed by Gustave Eiffel and completed in 1889.
-Outputs:
-"Eiffel Tower"|"located"|"Paris"
-"Eiffel Tower"|"designed by"|"Gustave Eiffel"
-"Eiffel Tower"|"completed"|"1889"
-
-Example 3:
-Input: Barack Obama served as the 44th president of the United States from 2009 to 2017.
-Outputs:
-"Barack Obama"|"served as"|"44th president"
-"Barack Obama"|"president of"|"United States"
-"Barack Obama"|"served from"|"2009"
-"Barack Obama"|"served until"|"2017"
-
-Example 4:
-Input: Roberts & Vinter came under financial pressure after their printer went bankrupt.
-Outputs:
-"Roberts & Vinter"|"came under"|"financial pressure"
-"Roberts & Vinter"|"impacted by"|"printer bankruptcy"
-
-Example 4:
-Input: FBI Mortgage Fraud Department came into existence.
-Outputs:
-"FBI Mortgage Fraud Department"|"came into"|"existence"
-
-Example 5:
-Input: Tyler Bates worked with films like "Dawn of the Dead, 300, Sucker Punch," and "John Wick." He has collaborated with directors like Zack Snyder, Rob Zombie, Neil Marshall, William Friedkin, Scott Derrickson, and James Gunn.
-Outputs: 
-"Tyler Bates"|"known for film"|"Dawn of the Dead"
-"Tyler Bates"|"known for film"|"300"
-"Tyler Bates"|"known for film"|"Sucker Punch"
-"Tyler Bates"|"known for film"|"John Wick"
-"Tyler Bates"|"collaborated with"|"Zack Snyder"
-"Tyler Bates"|"collaborated with"|"Rob Zombie"
-"Tyler Bates"|"collaborated with"|"Neil Marshall"
-"Tyler Bates"|"collaborated with"|"William Friedkin"
-"Tyler Bates"|"collaborated with"|"Scott Derrickson"
-"Tyler Bates"|"collaborated with"|"James Gunn"
+{examples}
 
 Text:
 {text}
 """
-    response = co.chat(
-        model="command-a-03-2025",
-        messages=[{'role': 'user', 'content': prompt}]
-    )
-    result = ""
-    for item in response.message.content:
-        if item.type == 'text':
-            result += item.text
-    return result.strip()
+
+def generate_text(text, chunk_id=None, pass_name="base"):
+    if FEW_SHOT_MODE == "compare":
+        return compare_prompts(lambda p: call_llm(p, escalate=False), build_extraction_prompt, text,
+                               FEW_SHOT_STATS_CSV, chunk_id, pass_name)
+    # izlaz originalnog teksta sa zamjenicom ionako zamjenjuje rewrite + ponovna ekstrakcija
+    return call_llm(build_extraction_prompt(text), pronoun_fallback=(pass_name == "base"))
 
 def rewrite_chunk_with_context(current_text, prev_chunks):
     """
@@ -115,44 +115,7 @@ CURRENT CHUNK:
 {current_text}
 """
 
-    response = co.chat(
-        model="command-a-03-2025",
-        messages=[{'role': 'user', 'content': prompt}]
-    )
-    result = ""
-    for item in response.message.content:
-        if item.type == 'text':
-            result += item.text
-    return result.strip()
-
-def is_valid_triplet(parts):
-    if len(parts) != 3:
-        return False
-    for p in parts:
-        val = p.strip().lower()
-        if val == "" or val == "null":
-            return False
-    return True
-
-def normalize_triplet_line(line):
-    # Ujednači razmake oko delimiter-a
-    return line.replace('" | "', '"|"').replace('" |"', '"|"').replace('"| "', '"|"')
-
-def entity_contains_pronoun(entity_text):
-    """Provjera da li subjekt ili objekt sadrži ijednu zamjenicu iz skupa, po riječima (sa granicom riječi)."""
-    tokens = [t.lower() for t in WORD_RE.findall(entity_text)]
-    return any(tok in PRONOUNS for tok in tokens)
-
-def triplets_have_pronoun_in_SO(triplets_text):
-    """True ako ijedan triplet ima zamjenicu u subjektu ili objektu."""
-    for raw_line in triplets_text.splitlines():
-        line = normalize_triplet_line(raw_line)
-        parts = line.strip().strip('"').split('"|"')
-        if len(parts) >= 3:
-            subj, obj = parts[0], parts[2]
-            if entity_contains_pronoun(subj) or entity_contains_pronoun(obj):
-                return True
-    return False
+    return call_llm(prompt, tier="context", escalate=False)
 
 def get_prev_chunks_same_question(df, idx, question_id, k=2):
     """
@@ -168,97 +131,98 @@ def get_prev_chunks_same_question(df, idx, question_id, k=2):
         j -= 1
     return prev_chunks
 
-# Ulazni fajl sa paragrafima
-df = pd.read_csv("paragraph_chunks2.csv")
-
-# Bitno: sortiraj po chunk_ID da bi "prethodna 2" bila određena stabilno
-if 'chunk_ID' in df.columns:
-    df = df.sort_values(by='chunk_ID', ascending=True).reset_index(drop=True)
-
-start_context_id = 126083
-
-# Izlazni fajl sa tripletima
-triplets_file = "triplets_with_index_chunks.csv"
-
-# Folder i fajl za loše formatirane triplete
-bad_folder = "bad_form_triplets_chunks"
-os.makedirs(bad_folder, exist_ok=True)
-bad_triplets_file = os.path.join(bad_folder, "bad_triplets_chunks.csv")
-
-# --- Proveri postojeće triplete da ne dupliraš ---
-processed_ids = set()
-if os.path.isfile(triplets_file):
-    try:
-        existing = pd.read_csv(triplets_file, delimiter='|', quotechar='"')
-        if 'chunk_ID' in existing.columns:
-            processed_ids = set(existing['chunk_ID'].tolist())
-    except Exception as e:
-        print(f"⚠️ Greška pri čitanju postojećih tripleta: {e}")
-
-# Proveri da li fajlovi postoje
-file_exists = os.path.isfile(triplets_file)
-bad_file_exists = os.path.isfile(bad_triplets_file)
-
-# Priprema CSV fajlova
-with open(triplets_file, "a", encoding="utf-8", newline="") as csvfile, \
-     open(bad_triplets_file, "a", encoding="utf-8", newline="") as badfile:
-
-    writer = csv.writer(csvfile, delimiter='|', quoting=csv.QUOTE_MINIMAL)
-    bad_writer = csv.writer(badfile, delimiter='|', quoting=csv.QUOTE_MINIMAL)
-
-    # Zaglavlja
-    if not file_exists:
-        writer.writerow(["chunk_ID", "question_ID", "triplet"])
-    if not bad_file_exists:
-        bad_writer.writerow(["chunk_ID", "question_ID", "bad_triplet"])
-
-    # Iteracija
-    for idx, row in df.iterrows():
-        paragraph_id = row['chunk_ID']
-        question_id = row['question_ID'] if 'question_ID' in row else None
-
-        if paragraph_id < start_context_id:
-            continue
-
-        # preskoči ako je već obrađen (po postojećem fajlu)
-        if paragraph_id in processed_ids:
-            print(f"⏭️ Skipping already processed chunk {paragraph_id}")
-            continue
-
-        text = row['chunk']
-        print(f"Generating triplets for chunk {paragraph_id}...")
-
-        # 1) Prvo generiši triplete iz originalnog teksta
-        triplets = generate_text(text)
-
-        # 2) Ako ijedan triplet ima zamjenicu u subjektu/objektu -> rezolucija i regenerisanje
-        if triplets and triplets_have_pronoun_in_SO(triplets):
-            prev_chunks = get_prev_chunks_same_question(df, idx, question_id, k=2)
-
-            if prev_chunks:
-                print(f"↪️ Pronoun detected in chunk {paragraph_id}. Resolving with SAME-question context ({len(prev_chunks)} prev chunks)...")
-            else:
-                print(f"↪️ Pronoun detected in chunk {paragraph_id}, but no prior chunks with the same question_ID. Resolving without context...")
-
-            rewritten_text = rewrite_chunk_with_context(text, prev_chunks)
-
-            # Ako je model dao nešto smisleno, generiši triplete iz prepisanog
-            if rewritten_text:
-                triplets = generate_text(rewritten_text)
-                print(f"✅ Re-generated triplets for chunk {paragraph_id} after pronoun resolution.")
-            else:
-                print(f"⚠️ Pronoun resolution returned empty for chunk {paragraph_id}. Using original triplets.")
-
-        # 3) Upis rezultata (dobri/loši) – ista logika kao ranije
-        for line in triplets.splitlines() if triplets else []:
-            clean_line = normalize_triplet_line(line)
-            parts = clean_line.strip().strip('"').split('"|"')
-            if is_valid_triplet(parts):
-                writer.writerow([paragraph_id, question_id, line.strip()])
-            else:
-                bad_writer.writerow([paragraph_id, question_id, line.strip()])
-                print(f"⚠️ Skipped bad triplet at context {paragraph_id}: {line.strip()}")
-
-print(f"\nSaved good triplets to {triplets_file}")
-print(f"Saved bad triplets to {bad_triplets_file}")
+# ======= Main pipeline (Method 1) =======
+
+def load_chunks(path: str = INPUT_CSV) -> pd.DataFrame:
+    df = pd.read_csv(path)
+    # Bitno: sortiraj po chunk_ID da bi "prethodna 2" bila određena stabilno
+    if 'chunk_ID' in df.columns:
+        df = df.sort_values(by='chunk_ID', ascending=True).reset_index(drop=True)
+    return df
 
+def run(df, output_csv=OUTPUT_CSV, bad_csv=BAD_CSV, parquet_dir=PARQUET_DIR, should_stop=None,
+        start_chunk_id=None):
+    """
+    Obradi chunkove iz df (sortiran, reset_index) i upiši triplete.
+    should_stop: opcionalna funkcija; ako vrati True, obrada staje prije sljedećeg chunka.
+    start_chunk_id: donja granica chunk_ID-a (None = START_CHUNK_ID; shard mod daje 0, opseg je shard).
+    """
+    if start_chunk_id is None:
+        start_chunk_id = START_CHUNK_ID
+    # --- Završeni chunkovi (journal); redovi nedovršenih se odsijecaju iz izlaza ---
+    processed_ids = recover_outputs(OUTPUT_FORMAT, output_csv, bad_csv, parquet_dir)
+
+    # Priprema izlaza (CSV i/ili Parquet)
+    sinks = open_sinks(OUTPUT_FORMAT, output_csv, bad_csv, parquet_dir, method="m1",
+                       dedup=DEDUP, dedup_max_questions=DEDUP_MAX_QUESTIONS,
+                       dedup_max_keys=DEDUP_MAX_KEYS)
+    with GroupCommitWriter(sinks, journal_path(output_csv), WRITER_FLUSH_ROWS,
+                           WRITER_FLUSH_SECONDS) as sink:
+
+        # Iteracija
+        for idx, row in df.iterrows():
+            if should_stop and should_stop():
+                print("⛔ Stopping early (should_stop).")
+                break
+
+            paragraph_id = row['chunk_ID']
+            question_id = row['question_ID'] if 'question_ID' in row else None
+
+            if paragraph_id < start_chunk_id:
+                continue
+
+            # preskoči ako je već obrađen (po postojećem fajlu)
+            if paragraph_id in processed_ids:
+                print(f"⏭️ Skipping already processed chunk {paragraph_id}")
+                continue
+
+            text = row['chunk']
+            print(f"Generating triplets for chunk {paragraph_id}...")
+
+            # 1) Prvo generiši triplete iz originalnog teksta
+            triplets = generate_text(text, paragraph_id)
+            parsed = parse_response(triplets)
+
+            # 2) Ako ijedan triplet ima zamjenicu u subjektu/objektu -> rezolucija i regenerisanje
+            if has_pronoun_in_SO(parsed):
+                prev_chunks = get_prev_chunks_same_question(df, idx, question_id, k=K_PREV)
+
+                if prev_chunks:
+                    print(f"↪️ Pronoun detected in chunk {paragraph_id}. Resolving with SAME-question context ({len(prev_chunks)} prev chunks)...")
+                else:
+                    print(f"↪️ Pronoun detected in chunk {paragraph_id}, but no prior chunks with the same question_ID. Resolving without context...")
+
+                rewritten_text = rewrite_chunk_with_context(text, prev_chunks)
+
+                # Ako je model dao nešto smisleno, generiši triplete iz prepisanog
+                if rewritten_text:
+                    triplets = generate_text(rewritten_text, paragraph_id, "rewritten")
+                    parsed = parse_response(triplets)
+                    print(f"✅ Re-generated triplets for chunk {paragraph_id} after pronoun resolution.")
+                else:
+                    print(f"⚠️ Pronoun resolution returned empty for chunk {paragraph_id}. Using original triplets.")
+                    if REPAIR:  # original nije popravljan (očekivao se rewrite)
+                        parsed = repair_lines(parsed)
+
+            # 3) Upis rezultata (dobri/loši) – ista logika kao ranije
+            for t in parsed:
+                if t.valid:
+                    sink.add_good(paragraph_id, question_id, t)
+                else:
+                    sink.add_bad(paragraph_id, question_id, t.raw, t.reason)
+                    print(f"⚠️ Skipped bad triplet at context {paragraph_id}: {t.raw}")
+            sink.chunk_done(paragraph_id)
+
+    llm.report()
+
+def main():
+    os.makedirs(BAD_DIR, exist_ok=True)
+    run(load_chunks())
+
+    print(f"\nSaved good triplets to {OUTPUT_CSV}")
+    print(f"Saved bad triplets to {BAD_CSV}")
+    if OUTPUT_FORMAT != "csv":
+        print(f"Saved columnar triplets to {PARQUET_DIR}/good and {PARQUET_DIR}/bad")
+
+if __name__ == "__main__":
+    main()
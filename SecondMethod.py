@@ -1,38 +1,69 @@
 import cohere
 import pandas as pd
 import sys
-import csv
 import os
 import time
-import re
+
+from triplet_parser import parse_response, has_pronoun_in_SO, line_has_pronoun_in_SO
+from llm_client import Hedger, TieredLLM
+from triplet_repair import repair_triplets
+from few_shot import examples_block, compare_prompts
+from triplet_sink import open_sinks
+from triplet_writer import GroupCommitWriter, journal_path, recover_outputs
+from context_compaction import compact_context
+from entity_memory import QuestionMemories, format_entities
 
 # ======= CONFIG =======
 co = cohere.ClientV2("Your API key")
-MODEL_NAME = "command-a-03-2025"
+MODEL_TIERS = {
+    "base": "command-r7b-12-2024",    # 1. prolaz (većina chunkova): manji i brži model
+    "context": "command-a-03-2025",   # prolazi sa kontekstom / rewrite
+    "escalate": "command-a-03-2025",  # ponovi prolaz kad izlaz nije validan (None = bez eskalacije)
+}
+HEDGE = True                # duplikat poziva kad odgovor kasni preko percentila nedavnih latencija
+HEDGE_PERCENTILE = 0.95
+HEDGE_MAX_RATE = 0.05       # max udio poziva koji dobiju hedge
+HEDGE_MIN_SAMPLES = 20      # bez hedge-a dok nema dovoljno izmjerenih latencija (po modelu)
+REPAIR = True               # linije koje krše pravila prompta šalju se nazad kratkim fix-up promptom
+REPAIR_MAX_ROUNDS = 2       # max fix-up poziva po odgovoru
+REPAIR_MAX_LINES = 20       # max linija po fix-up promptu
+STREAM_BASE = True  # 1. prolaz kao stream: prekini čim linija ima zamjenicu u S/O (ionako ide 2. prolaz)
 
 INPUT_CSV = "paragraph_chunks2.csv"
 OUTPUT_CSV = "triplets_with_index_chunks_m2.csv"
 BAD_DIR = "bad_form_triplets_chunks_m2"
 BAD_CSV = os.path.join(BAD_DIR, "bad_triplets_chunks_m2.csv")
 
+OUTPUT_FORMAT = "csv"     # "csv" | "parquet" | "both" (parquet traži pyarrow)
+PARQUET_DIR = "triplets_m2_parquet"  # <dir>/good i <dir>/bad dataseti
+DEDUP = True              # ne upisuj isti (normalizovan) triplet dva puta za isti question_ID
+DEDUP_MAX_QUESTIONS = 256 # koliko aktivnih question_ID-a se pamti (LRU)
+DEDUP_MAX_KEYS = 10_000   # max ključeva po question_ID-u
+WRITER_FLUSH_ROWS = 500   # commit (flush + fsync + journal) nakon ovoliko redova...
+WRITER_FLUSH_SECONDS = 2.0 # ...ili nakon ovoliko sekundi
+
 START_CHUNK_ID = 128176   # možeš promijeniti po potrebi
 K_PREV = 2                # koliko prethodnih chunkova ubacujemo u 2. prolazu
 
-# --- Skup zamjenica (lowercase) ---
-PRONOUNS = {
-    "i","me","myself","my","mine",
-    "he","him","himself","his",
-    "she","her","herself","hers",
-    "it","itself","its",
-    "they","them","themselves","themself","their","theirs",
-    "who","whom","whose"
-}
+COMPACT_CONTEXT = True        # u kontekst idu samo rečenice s kandidatima za antecedent
+CONTEXT_TOKEN_BUDGET = 300    # max (procijenjenih) tokena konteksta po promptu
 
-WORD_RE = re.compile(r"\b[\w&'’-]+\b", flags=re.UNICODE)
+CONTEXT_SOURCE = "chunks"     # "chunks" (prethodni chunkovi) | "memory" (top-N entiteta po question_ID)
+MEMORY_TOP_N = 15             # koliko entiteta ide u prompt
+MEMORY_MAX_ENTITIES = 64      # max entiteta u memoriji jednog question_ID-a
+
+FEW_SHOT_MODE = "full"          # "full" | "adaptive" | "compare" (mjerenje: oba prompta, u izlaz ide full)
+FEW_SHOT_MAX = 2                # adaptive: max broj primjera po promptu
+FEW_SHOT_TOKEN_BUDGET = 250     # adaptive: max (procijenjenih) tokena za primjere
+FEW_SHOT_STATS_CSV = "few_shot_stats_m2.csv"
 
 # ======= PROMPTS =======
 
-def build_base_extraction_prompt(text: str) -> str:
+def few_shot_examples(text: str, few_shot: str = None) -> str:
+    return examples_block(text, few_shot or FEW_SHOT_MODE, FEW_SHOT_MAX, FEW_SHOT_TOKEN_BUDGET)
+
+def build_base_extraction_prompt(text: str, few_shot: str = None) -> str:
+    examples = few_shot_examples(text, few_shot)
     return f"""Extract only factual triplets from the following text in the format: "Subject"|"Relation"|"Object".
 STRICT RULES:
 - Each line MUST contain exactly 3 parts: subject, relation, object.
@@ -42,64 +73,27 @@ STRICT RULES:
 - If you cannot extract a valid triplet under these rules, skip it (do not generate).
 - Output only valid triplets, one per sentence.
 
-Example 1:
-Input: Albert Einstein developed the theory of relativity while working in Switzerland.
-Outputs:
-"Albert Einstein"|"developed"|"theory of relativity"
-"Albert Einstein"|"worked in"|"Switzerland"
-
-Example 2:
-Input: The Eiffel Tower in Paris was designed by Gustave Eiffel and completed in 1889.
-Outputs:
-"Eiffel Tower"|"located"|"Paris"
-"Eiffel Tower"|"designed by"|"Gustave Eiffel"
-"Eiffel Tower"|"completed"|"1889"
-
-Example 3:
-Input: Barack Obama served as the 44th president of the United States from 2009 to 2017.
-Outputs:
-"Barack Obama"|"served as"|"44th president"
-"Barack Obama"|"president of"|"United States"
-"Barack Obama"|"served from"|"2009"
-"Barack Obama"|"served until"|"2017"
-
-Example 4:
-Input: Roberts & Vinter came under financial pressure after their printer went bankrupt.
-Outputs:
-"Roberts & Vinter"|"came under"|"financial pressure"
-"Roberts & Vinter"|"impacted by"|"printer bankruptcy"
-
-Example 5:
-Input: FBI Mortgage Fraud Department came into existence.
-Outputs:
-"FBI Mortgage Fraud Department"|"came into"|"existence"
-
-Example 6:
-Input: Tyler Bates worked with films like "Dawn of the Dead, 300, Sucker Punch," and "John Wick." He has collaborated with directors like Zack Snyder, Rob Zombie, Neil Marshall, William Friedkin, Scott Derrickson, and James Gunn.
-Outputs: 
-"Tyler Bates"|"known for film"|"Dawn of the Dead"
-"Tyler Bates"|"known for film"|"300"
-"Tyler Bates"|"known for film"|"Sucker Punch"
-"Tyler Bates"|"known for film"|"John Wick"
-"Tyler Bates"|"collaborated with"|"Zack Snyder"
-"Tyler Bates"|"collaborated with"|"Rob Zombie"
-"Tyler Bates"|"collaborated with"|"Neil Marshall"
-"Tyler Bates"|"collaborated with"|"William Friedkin"
-"Tyler Bates"|"collaborated with"|"Scott Derrickson"
-"Tyler Bates"|"collaborated with"|"James Gunn"
+{examples}
 
 Text:
 {text}
 """
 
-def build_context_extraction_prompt(current_text: str, prev_chunks: list[str]) -> str:
+def build_context_extraction_prompt(current_text: str, prev_chunks: list[str],
+                                    entities: list[str] = None) -> str:
     """
     Prompt za 2. prolaz: koristi (do) 2 prethodna chunka + trenutni tekst kao JEDAN ulaz,
     rezolvira zamjenice na osnovu konteksta i IZVADI TRIPLETE sa eksplicitnim entitetima.
+    Ako su date entities (memorija), kontekst je lista entiteta umjesto teksta chunkova.
     """
-    context_str = "\n\n".join(
-        [f"[Prev {i+1}] {t}" for i, t in enumerate(prev_chunks)]
-    ) if prev_chunks else "(no prior context)"
+    examples = few_shot_examples(current_text)
+    if entities:
+        context_str = "Known entities from earlier chunks (most salient first):\n" + \
+            "\n".join(format_entities(entities))
+    else:
+        context_str = "\n\n".join(
+            [f"[Prev {i+1}] {t}" for i, t in enumerate(prev_chunks)]
+        ) if prev_chunks else "(no prior context)"
 
     return f"""Extract only factual triplets from the following text in the format: "Subject"|"Relation"|"Object". You are an information extraction system that MUST resolve pronouns using earlier context.
 
@@ -115,51 +109,7 @@ STRICT RULES:
 - If you cannot extract a valid triplet under these rules, skip it (do not generate).
 - Output only valid triplets, one per sentence.
 
-Example 1:
-Input: Albert Einstein developed the theory of relativity while working in Switzerland.
-Outputs:
-"Albert Einstein"|"developed"|"theory of relativity"
-"Albert Einstein"|"worked in"|"Switzerland"
-
-Example 2:
-Input: The Eiffel Tower in Paris was designed by Gustave Eiffel and completed in 1889.
-Outputs:
-"Eiffel Tower"|"located"|"Paris"
-"Eiffel Tower"|"designed by"|"Gustave Eiffel"
-"Eiffel Tower"|"completed"|"1889"
-
-Example 3:
-Input: Barack Obama served as the 44th president of the United States from 2009 to 2017.
-Outputs:
-"Barack Obama"|"served as"|"44th president"
-"Barack Obama"|"president of"|"United States"
-"Barack Obama"|"served from"|"2009"
-"Barack Obama"|"served until"|"2017"
-
-Example 4:
-Input: Roberts & Vinter came under financial pressure after their printer went bankrupt.
-Outputs:
-"Roberts & Vinter"|"came under"|"financial pressure"
-"Roberts & Vinter"|"impacted by"|"printer bankruptcy"
-
-Example 5:
-Input: FBI Mortgage Fraud Department came into existence.
-Outputs:
-"FBI Mortgage Fraud Department"|"came into"|"existence"
-
-Example 6:
-Input: Tyler Bates worked with films like "Dawn of the Dead, 300, Sucker Punch," and "John Wick." He has collaborated with directors like Zack Snyder, Rob Zombie, Neil Marshall, William Friedkin, Scott Derrickson, and James Gunn.
-Outputs: 
-"Tyler Bates"|"known for film"|"Dawn of the Dead"
-"Tyler Bates"|"known for film"|"300"
-"Tyler Bates"|"known for film"|"Sucker Punch"
-"Tyler Bates"|"known for film"|"John Wick"
-"Tyler Bates"|"collaborated with"|"Zack Snyder"
-"Tyler Bates"|"collaborated with"|"Rob Zombie"
-"Tyler Bates"|"collaborated with"|"Neil Marshall"
-"Tyler Bates"|"collaborated with"|"William Friedkin"
-"Tyler Bates"|"collaborated with"|"Scott Derrickson"
-"Tyler Bates"|"collaborated with"|"James Gunn"
+{examples}
 
 EARLIER CONTEXT:
 {context_str}
@@ -170,51 +120,43 @@ CURRENT CHUNK:
 
 # ======= LLM wrappers =======
 
-def call_llm(prompt: str) -> str:
-    resp = co.chat(
-        model=MODEL_NAME,
-        messages=[{'role': 'user', 'content': prompt}]
-    )
-    out = ""
-    for item in resp.message.content:
-        if item.type == 'text':
-            out += item.text
-    return out.strip()
+def repair_lines(parsed):
+    """Popravka samo linija koje krše pravila (jeftin "base" model, bez eskalacije)."""
+    parsed, stats = repair_triplets(parsed, lambda p: call_llm(p, "base", escalate=False),
+                                    REPAIR_MAX_ROUNDS, REPAIR_MAX_LINES)
+    if stats["offending"]:
+        print(f"🔧 Repaired {stats['repaired']}/{stats['offending']} line(s) in {stats['calls']} call(s)")
+    return parsed
 
-def generate_triplets_base(text: str) -> str:
-    return call_llm(build_base_extraction_prompt(text))
+# popravka ide prije eskalacije: skupi model se zove tek kad popravka ne spasi nijednu liniju
+llm = TieredLLM(MODEL_TIERS, Hedger(HEDGE_PERCENTILE, HEDGE_MAX_RATE, HEDGE_MIN_SAMPLES) if HEDGE else None,
+                repair_lines if REPAIR else None)
 
-def generate_triplets_with_context(current_text: str, prev_chunks: list[str]) -> str:
-    return call_llm(build_context_extraction_prompt(current_text, prev_chunks))
+def call_llm(prompt: str, tier: str = "base", abort_on=None, check_pronouns: bool = False,
+             escalate: bool = True, pronoun_fallback: bool = False) -> str:
+    """
+    tier: "base" | "context" (model iz MODEL_TIERS; nevalidan izlaz ide na "escalate").
+    abort_on(linija) -> bool: streaming mod, odgovor se prekida na prvoj liniji za koju vrati True.
+    pronoun_fallback: izlaz sa zamjenicom u S/O ide u 2. prolaz (bez popravke i eskalacije).
+    """
+    return llm.call(co, prompt, tier, abort_on, check_pronouns, escalate, pronoun_fallback)
+
+def generate_triplets_base(text: str, chunk_id=None, abort_on_pronoun: bool = False) -> str:
+    """abort_on_pronoun: smije se prekinuti na prvoj zamjenici samo ako će sigurno ići 2. prolaz."""
+    if FEW_SHOT_MODE == "compare":
+        return compare_prompts(lambda p: call_llm(p, escalate=False), build_base_extraction_prompt, text,
+                               FEW_SHOT_STATS_CSV, chunk_id)
+    abort_on = line_has_pronoun_in_SO if (STREAM_BASE and abort_on_pronoun) else None
+    return call_llm(build_base_extraction_prompt(text), "base", abort_on,
+                    pronoun_fallback=abort_on_pronoun)
+
+def generate_triplets_with_context(current_text: str, prev_chunks: list[str],
+                                   entities: list[str] = None) -> str:
+    return call_llm(build_context_extraction_prompt(current_text, prev_chunks, entities),
+                    "context", check_pronouns=True)
 
 # ======= Helpers =======
 
-def normalize_triplet_line(line: str) -> str:
-    return line.replace('" | "', '"|"').replace('" |"', '"|"').replace('"| "', '"|"')
-
-def is_valid_triplet(parts: list[str]) -> bool:
-    if len(parts) != 3:
-        return False
-    for p in parts:
-        val = p.strip().lower()
-        if val == "" or val == "null":
-            return False
-    return True
-
-def entity_contains_pronoun(entity_text: str) -> bool:
-    tokens = [t.lower() for t in WORD_RE.findall(entity_text)]
-    return any(tok in PRONOUNS for tok in tokens)
-
-def triplets_have_pronoun_in_SO(triplets_text: str) -> bool:
-    for raw_line in triplets_text.splitlines():
-        line = normalize_triplet_line(raw_line)
-        parts = line.strip().strip('"').split('"|"')
-        if len(parts) >= 3:
-            subj, obj = parts[0], parts[2]
-            if entity_contains_pronoun(subj) or entity_contains_pronoun(obj):
-                return True
-    return False
-
 def get_prev_chunks_same_question(df: pd.DataFrame, idx: int, question_id, k: int = 2) -> list[str]:
     prev_chunks = []
     j = idx - 1
@@ -226,44 +168,41 @@ def get_prev_chunks_same_question(df: pd.DataFrame, idx: int, question_id, k: in
 
 # ======= Main pipeline (Method 2) =======
 
-def main():
-    os.makedirs(BAD_DIR, exist_ok=True)
-
-    df = pd.read_csv(INPUT_CSV)
-
+def load_chunks(path: str = INPUT_CSV) -> pd.DataFrame:
+    df = pd.read_csv(path)
     # stabilan poredak
     if 'chunk_ID' in df.columns:
         df = df.sort_values(by='chunk_ID', ascending=True).reset_index(drop=True)
+    return df
 
-    # već obrađeni (da izbjegnemo duplikate)
-    processed_ids = set()
-    if os.path.isfile(OUTPUT_CSV):
-        try:
-            existing = pd.read_csv(OUTPUT_CSV, delimiter='|', quotechar='"')
-            if 'chunk_ID' in existing.columns:
-                processed_ids = set(existing['chunk_ID'].tolist())
-        except Exception as e:
-            print(f"⚠️ Greška pri čitanju postojećih tripleta: {e}")
-
-    file_exists = os.path.isfile(OUTPUT_CSV)
-    bad_file_exists = os.path.isfile(BAD_CSV)
-
-    with open(OUTPUT_CSV, "a", encoding="utf-8", newline="") as out_f, \
-         open(BAD_CSV, "a", encoding="utf-8", newline="") as bad_f:
-
-        good_w = csv.writer(out_f, delimiter='|', quoting=csv.QUOTE_MINIMAL)
-        bad_w = csv.writer(bad_f, delimiter='|', quoting=csv.QUOTE_MINIMAL)
-
-        if not file_exists:
-            good_w.writerow(["chunk_ID", "question_ID", "triplet"])
-        if not bad_file_exists:
-            bad_w.writerow(["chunk_ID", "question_ID", "bad_triplet"])
-
+def run(df: pd.DataFrame, output_csv: str = OUTPUT_CSV, bad_csv: str = BAD_CSV,
+        parquet_dir: str = PARQUET_DIR, should_stop=None, start_chunk_id: int = None):
+    """
+    Obradi chunkove iz df (sortiran, reset_index) i upiši triplete.
+    should_stop: opcionalna funkcija; ako vrati True, obrada staje prije sljedećeg chunka.
+    start_chunk_id: donja granica chunk_ID-a (None = START_CHUNK_ID; shard mod daje 0, opseg je shard).
+    """
+    if start_chunk_id is None:
+        start_chunk_id = START_CHUNK_ID
+    # već obrađeni (journal); redovi nedovršenih chunkova se odsijecaju iz izlaza
+    processed_ids = recover_outputs(OUTPUT_FORMAT, output_csv, bad_csv, parquet_dir)
+    ctx_tokens_saved = 0
+    memories = QuestionMemories(max_entities=MEMORY_MAX_ENTITIES) if CONTEXT_SOURCE == "memory" else None
+
+    sinks = open_sinks(OUTPUT_FORMAT, output_csv, bad_csv, parquet_dir, method="m2",
+                       dedup=DEDUP, dedup_max_questions=DEDUP_MAX_QUESTIONS,
+                       dedup_max_keys=DEDUP_MAX_KEYS)
+    with GroupCommitWriter(sinks, journal_path(output_csv), WRITER_FLUSH_ROWS,
+                           WRITER_FLUSH_SECONDS) as sink:
         for idx, row in df.iterrows():
+            if should_stop and should_stop():
+                print("⛔ Stopping early (should_stop).")
+                break
+
             chunk_id = row['chunk_ID']
             qid = row['question_ID'] if 'question_ID' in row else None
 
-            if chunk_id < START_CHUNK_ID:
+            if chunk_id < start_chunk_id:
                 continue
 
             if chunk_id in processed_ids:
@@ -273,41 +212,70 @@ def main():
             text = row['chunk']
             print(f"Generating triplets (base) for chunk {chunk_id}...")
 
-            # 1) Prvi prolaz: samo trenutni chunk
-            triplets = generate_triplets_base(text)
+            # 1) Prvi prolaz: samo trenutni chunk (zamjenica u S/O uvijek vodi u 2. prolaz, pa se smije prekinuti)
+            triplets = generate_triplets_base(text, chunk_id, abort_on_pronoun=True)
+            parsed = parse_response(triplets)
 
             # 2) Validacija: ako pronoun u S/O -> DRUGI PROLAZ sa ubačenim prethodnim chunkovima i drugačijim promptom
-            if triplets and triplets_have_pronoun_in_SO(triplets):
+            entities = memories.get(qid).top(MEMORY_TOP_N) if memories else []
+            if has_pronoun_in_SO(parsed) and entities:
+                print(f"↪️ Pronoun detected. Regenerating with {len(entities)} remembered entities for {chunk_id} ...")
+                triplets = generate_triplets_with_context(text, [], entities)
+                parsed = parse_response(triplets)
+            elif has_pronoun_in_SO(parsed):
                 prev_chunks = get_prev_chunks_same_question(df, idx, qid, k=K_PREV)
+                if COMPACT_CONTEXT and prev_chunks:
+                    compacted, stats = compact_context(prev_chunks, CONTEXT_TOKEN_BUDGET)
+                    # bez ijednog kandidata zadrži puni kontekst (antecedent može biti opisni)
+                    if compacted:
+                        prev_chunks = compacted
+                        ctx_tokens_saved += stats["saved"]
+                        print(f"🗜️ Context compacted for {chunk_id}: ~{stats['before']} -> ~{stats['after']} tokens (saved ~{stats['saved']})")
                 if prev_chunks:
                     print(f"↪️ Pronoun detected. Regenerating with {len(prev_chunks)} prior chunk(s) context for {chunk_id} ...")
                 else:
                     print(f"↪️ Pronoun detected but no prior chunks for same question_ID. Regenerating without context (will behave like base).")
 
                 triplets = generate_triplets_with_context(text, prev_chunks)
+                parsed = parse_response(triplets)
 
                 # opcionalno: ako i poslije konteksta i dalje imamo pronoun u S/O, možemo napisati u bad
                 # ali ovdje ćemo svejedno pokušati zapisati validne linije.
 
             # 3) Upis (razdvajamo validne i loše formatirane)
             wrote_any = False
-            for line in triplets.splitlines() if triplets else []:
-                clean = normalize_triplet_line(line)
-                parts = clean.strip().strip('"').split('"|"')
-                if is_valid_triplet(parts):
-                    good_w.writerow([chunk_id, qid, line.strip()])
+            for t in parsed:
+                if t.valid:
+                    sink.add_good(chunk_id, qid, t)
                     wrote_any = True
                 else:
-                    bad_w.writerow([chunk_id, qid, line.strip()])
-                    print(f"⚠️ Skipped bad triplet at chunk {chunk_id}: {line.strip()}")
+                    sink.add_bad(chunk_id, qid, t.raw, t.reason)
+                    print(f"⚠️ Skipped bad triplet at chunk {chunk_id}: {t.raw}")
 
             if not wrote_any:
                 # ako ništa validno — evidentiraj u bad fajlu radi praćenja
-                bad_w.writerow([chunk_id, qid, (triplets or "").strip() or "(empty)"])
+                sink.add_bad(chunk_id, qid, (triplets or "").strip() or "(empty)", "no_valid")
                 print(f"⚠️ No valid triplets for chunk {chunk_id}.")
 
+            if memories:
+                mem = memories.get(qid)
+                mem.next_chunk()
+                mem.observe_triplets(parsed)
+
+            sink.chunk_done(chunk_id)
+
+    llm.report()
+    if COMPACT_CONTEXT:
+        print(f"\n🗜️ Context compaction saved ~{ctx_tokens_saved} prompt tokens in total")
+
+def main():
+    os.makedirs(BAD_DIR, exist_ok=True)
+    run(load_chunks())
+
     print(f"\nSaved good triplets to {OUTPUT_CSV}")
     print(f"Saved bad triplets to {BAD_CSV}")
+    if OUTPUT_FORMAT != "csv":
+        print(f"Saved columnar triplets to {PARQUET_DIR}/good and {PARQUET_DIR}/bad")
 
 if __name__ == "__main__":
     main()
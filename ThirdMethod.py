@@ -1,35 +1,63 @@
 import cohere
 import pandas as pd
-import csv
 import os
-import re
 from typing import List, Dict
 
+from triplet_parser import parse_response, has_pronoun_in_SO, line_has_pronoun_in_SO
+from llm_client import Hedger, TieredLLM
+from triplet_repair import repair_triplets
+from few_shot import examples_block, compare_prompts
+from triplet_sink import open_sinks
+from triplet_writer import GroupCommitWriter, journal_path, recover_outputs
+from entity_memory import QuestionMemories, format_entities
+
 # ============== CONFIG ==============
 co = cohere.ClientV2("Your API key")
-MODEL_NAME = "command-a-03-2025"
+MODEL_TIERS = {
+    "base": "command-r7b-12-2024",    # 1. prolaz (većina chunkova): manji i brži model
+    "context": "command-a-03-2025",   # prolazi sa kontekstom / rewrite
+    "escalate": "command-a-03-2025",  # ponovi prolaz kad izlaz nije validan (None = bez eskalacije)
+}
+HEDGE = True                # duplikat poziva kad odgovor kasni preko percentila nedavnih latencija
+HEDGE_PERCENTILE = 0.95
+HEDGE_MAX_RATE = 0.05       # max udio poziva koji dobiju hedge
+HEDGE_MIN_SAMPLES = 20      # bez hedge-a dok nema dovoljno izmjerenih latencija (po modelu)
+REPAIR = True               # linije koje krše pravila prompta šalju se nazad kratkim fix-up promptom
+REPAIR_MAX_ROUNDS = 2       # max fix-up poziva po odgovoru
+REPAIR_MAX_LINES = 20       # max linija po fix-up promptu
+STREAM_BASE = True  # 1. prolaz kao stream: prekini čim linija ima zamjenicu u S/O (ionako ide 2. prolaz)
 
 INPUT_CSV = "paragraph_chunks2.csv"
 OUTPUT_CSV = "triplets_with_index_chunks_m3.csv"
 BAD_DIR = "bad_form_triplets_chunks_m3"
 BAD_CSV = os.path.join(BAD_DIR, "bad_triplets_chunks_m3.csv")
 
+OUTPUT_FORMAT = "csv"     # "csv" | "parquet" | "both" (parquet traži pyarrow)
+PARQUET_DIR = "triplets_m3_parquet"  # <dir>/good i <dir>/bad dataseti
+DEDUP = True              # ne upisuj isti (normalizovan) triplet dva puta za isti question_ID
+DEDUP_MAX_QUESTIONS = 256 # koliko aktivnih question_ID-a se pamti (LRU)
+DEDUP_MAX_KEYS = 10_000   # max ključeva po question_ID-u
+WRITER_FLUSH_ROWS = 500   # commit (flush + fsync + journal) nakon ovoliko redova...
+WRITER_FLUSH_SECONDS = 2.0 # ...ili nakon ovoliko sekundi
+
 START_CHUNK_ID = 399  # promijeni ako želiš preskočiti ranije chunkove
 K_PREV = 2          # koliko prethodnih chunkova (sa istim question_ID) gledamo
 
-# ============== LINGVO ==============
-PRONOUNS = {
-    "i","me","myself","my","mine",
-    "he","him","himself","his",
-    "she","her","herself","hers",
-    "it","itself","its",
-    "they","them","themselves","themself","their","theirs",
-    "who","whom","whose"
-}
-WORD_RE = re.compile(r"\b[\w&'’-]+\b", flags=re.UNICODE)
+CONTEXT_SOURCE = "triplets"   # "triplets" (tripleti zadnjih K_PREV chunkova) | "memory" (top-N entiteta po question_ID)
+MEMORY_TOP_N = 15             # koliko entiteta ide u prompt
+MEMORY_MAX_ENTITIES = 64      # max entiteta u memoriji jednog question_ID-a
+
+FEW_SHOT_MODE = "full"          # "full" | "adaptive" | "compare" (mjerenje: oba prompta, u izlaz ide full)
+FEW_SHOT_MAX = 2                # adaptive: max broj primjera po promptu
+FEW_SHOT_TOKEN_BUDGET = 250     # adaptive: max (procijenjenih) tokena za primjere
+FEW_SHOT_STATS_CSV = "few_shot_stats_m3.csv"
 
 # ============== PROMPTS ==============
-def build_base_extraction_prompt(text: str) -> str:
+def few_shot_examples(text: str, few_shot: str = None) -> str:
+    return examples_block(text, few_shot or FEW_SHOT_MODE, FEW_SHOT_MAX, FEW_SHOT_TOKEN_BUDGET)
+
+def build_base_extraction_prompt(text: str, few_shot: str = None) -> str:
+    examples = few_shot_examples(text, few_shot)
     return f"""Extract only factual triplets from the following text in the format: "Subject"|"Relation"|"Object".
 STRICT RULES:
 - Each line MUST contain exactly 3 parts: subject, relation, object.
@@ -39,65 +67,24 @@ STRICT RULES:
 - If you cannot extract a valid triplet under these rules, skip it (do not generate).
 - Output only valid triplets, one per sentence.
 
-Example 1:
-Input: Albert Einstein developed the theory of relativity while working in Switzerland.
-Outputs:
-"Albert Einstein"|"developed"|"theory of relativity"
-"Albert Einstein"|"worked in"|"Switzerland"
-
-Example 2:
-Input: The Eiffel Tower in Paris was designed by Gustave Eiffel and completed in 1889.
-Outputs:
-"Eiffel Tower"|"located"|"Paris"
-"Eiffel Tower"|"designed by"|"Gustave Eiffel"
-"Eiffel Tower"|"completed"|"1889"
-
-Example 3:
-Input: Barack Obama served as the 44th president of the United States from 2009 to 2017.
-Outputs:
-"Barack Obama"|"served as"|"44th president"
-"Barack Obama"|"president of"|"United States"
-"Barack Obama"|"served from"|"2009"
-"Barack Obama"|"served until"|"2017"
-
-Example 4:
-Input: Roberts & Vinter came under financial pressure after their printer went bankrupt.
-Outputs:
-"Roberts & Vinter"|"came under"|"financial pressure"
-"Roberts & Vinter"|"impacted by"|"printer bankruptcy"
-
-Example 5:
-Input: FBI Mortgage Fraud Department came into existence.
-Outputs:
-"FBI Mortgage Fraud Department"|"came into"|"existence"
-
-Example 6:
-Input: Tyler Bates worked with films like "Dawn of the Dead, 300, Sucker Punch," and "John Wick." He has collaborated with directors like Zack Snyder, Rob Zombie, Neil Marshall, William Friedkin, Scott Derrickson, and James Gunn.
-Outputs:
-"Tyler Bates"|"known for film"|"Dawn of the Dead"
-"Tyler Bates"|"known for film"|"300"
-"Tyler Bates"|"known for film"|"Sucker Punch"
-"Tyler Bates"|"known for film"|"John Wick"
-"Tyler Bates"|"collaborated with"|"Zack Snyder"
-"Tyler Bates"|"collaborated with"|"Rob Zombie"
-"Tyler Bates"|"collaborated with"|"Neil Marshall"
-"Tyler Bates"|"collaborated with"|"William Friedkin"
-"Tyler Bates"|"collaborated with"|"Scott Derrickson"
-"Tyler Bates"|"collaborated with"|"James Gunn"
+{examples}
 
 Text:
 {text}
 """
 
 def build_context_from_prev_triplets_prompt(current_text: str,
-                                            context_triplets: List[str]) -> str:
-    ctx = "\n".join(context_triplets) if context_triplets else "(no prior triplets)"
-    return f"""You are an information extraction system that MUST resolve pronouns in the CURRENT CHUNK using ONLY the PRIOR TRIPLETS as context.
-PRIOR TRIPLETS provide explicit entities and relations. Replace pronouns in your understanding (he/she/it/they/his/her/their/its/I/me/my...) with the most plausible explicit entity grounded in PRIOR TRIPLETS, when possible.
+                                            context_triplets: List[str],
+                                            label: str = "PRIOR TRIPLETS") -> str:
+    # label = "PRIOR ENTITIES" kad kontekst dolazi iz memorije entiteta
+    ctx = "\n".join(context_triplets) if context_triplets else f"(no {label.lower()})"
+    examples = few_shot_examples(current_text)
+    return f"""You are an information extraction system that MUST resolve pronouns in the CURRENT CHUNK using ONLY the {label} as context.
+{label} provide explicit entities{" and relations" if label == "PRIOR TRIPLETS" else ", most salient first"}. Replace pronouns in your understanding (he/she/it/they/his/her/their/its/I/me/my...) with the most plausible explicit entity grounded in {label}, when possible.
 
 TASK:
 - Extract factual triplets from the CURRENT CHUNK only, in the strict format: "Subject"|"Relation"|"Object".
-- When a pronoun in the CURRENT CHUNK refers to an entity found in PRIOR TRIPLETS, you MUST output the explicit named entity instead of the pronoun.
+- When a pronoun in the CURRENT CHUNK refers to an entity found in {label}, you MUST output the explicit named entity instead of the pronoun.
 - Do NOT output triplets about the prior context unless they are also asserted in the CURRENT CHUNK.
 
 STRICT RULES:
@@ -108,53 +95,9 @@ STRICT RULES:
 - If you cannot extract a valid triplet under these rules, skip it (do not generate).
 - Output only valid triplets, one per sentence.
 
-Example 1:
-Input: Albert Einstein developed the theory of relativity while working in Switzerland.
-Outputs:
-"Albert Einstein"|"developed"|"theory of relativity"
-"Albert Einstein"|"worked in"|"Switzerland"
-
-Example 2:
-Input: The Eiffel Tower in Paris was designed by Gustave Eiffel and completed in 1889.
-Outputs:
-"Eiffel Tower"|"located"|"Paris"
-"Eiffel Tower"|"designed by"|"Gustave Eiffel"
-"Eiffel Tower"|"completed"|"1889"
-
-Example 3:
-Input: Barack Obama served as the 44th president of the United States from 2009 to 2017.
-Outputs:
-"Barack Obama"|"served as"|"44th president"
-"Barack Obama"|"president of"|"United States"
-"Barack Obama"|"served from"|"2009"
-"Barack Obama"|"served until"|"2017"
-
-Example 4:
-Input: Roberts & Vinter came under financial pressure after their printer went bankrupt.
-Outputs:
-"Roberts & Vinter"|"came under"|"financial pressure"
-"Roberts & Vinter"|"impacted by"|"printer bankruptcy"
-
-Example 5:
-Input: FBI Mortgage Fraud Department came into existence.
-Outputs:
-"FBI Mortgage Fraud Department"|"came into"|"existence"
-
-Example 6:
-Input: Tyler Bates worked with films like "Dawn of the Dead, 300, Sucker Punch," and "John Wick." He has collaborated with directors like Zack Snyder, Rob Zombie, Neil Marshall, William Friedkin, Scott Derrickson, and James Gunn.
-Outputs: 
-"Tyler Bates"|"known for film"|"Dawn of the Dead"
-"Tyler Bates"|"known for film"|"300"
-"Tyler Bates"|"known for film"|"Sucker Punch"
-"Tyler Bates"|"known for film"|"John Wick"
-"Tyler Bates"|"collaborated with"|"Zack Snyder"
-"Tyler Bates"|"collaborated with"|"Rob Zombie"
-"Tyler Bates"|"collaborated with"|"Neil Marshall"
-"Tyler Bates"|"collaborated with"|"William Friedkin"
-"Tyler Bates"|"collaborated with"|"Scott Derrickson"
-"Tyler Bates"|"collaborated with"|"James Gunn"
-
-PRIOR TRIPLETS:
+{examples}
+
+{label}:
 {ctx}
 
 CURRENT CHUNK:
@@ -162,51 +105,43 @@ CURRENT CHUNK:
 """
 
 # ============== LLM wrappers ==============
-def call_llm(prompt: str) -> str:
-    resp = co.chat(
-        model=MODEL_NAME,
-        messages=[{'role': 'user', 'content': prompt}]
-    )
-    out = ""
-    for item in resp.message.content:
-        if item.type == 'text':
-            out += item.text
-    return out.strip()
-
-def generate_triplets_base(text: str) -> str:
-    return call_llm(build_base_extraction_prompt(text))
+def repair_lines(parsed):
+    """Popravka samo linija koje krše pravila (jeftin "base" model, bez eskalacije)."""
+    parsed, stats = repair_triplets(parsed, lambda p: call_llm(p, "base", escalate=False),
+                                    REPAIR_MAX_ROUNDS, REPAIR_MAX_LINES)
+    if stats["offending"]:
+        print(f"🔧 Repaired {stats['repaired']}/{stats['offending']} line(s) in {stats['calls']} call(s)")
+    return parsed
+
+# popravka ide prije eskalacije: skupi model se zove tek kad popravka ne spasi nijednu liniju
+llm = TieredLLM(MODEL_TIERS, Hedger(HEDGE_PERCENTILE, HEDGE_MAX_RATE, HEDGE_MIN_SAMPLES) if HEDGE else None,
+                repair_lines if REPAIR else None)
+
+def call_llm(prompt: str, tier: str = "base", abort_on=None, check_pronouns: bool = False,
+             escalate: bool = True, pronoun_fallback: bool = False) -> str:
+    """
+    tier: "base" | "context" (model iz MODEL_TIERS; nevalidan izlaz ide na "escalate").
+    abort_on(linija) -> bool: streaming mod, odgovor se prekida na prvoj liniji za koju vrati True.
+    pronoun_fallback: izlaz sa zamjenicom u S/O ide u 2. prolaz (bez popravke i eskalacije).
+    """
+    return llm.call(co, prompt, tier, abort_on, check_pronouns, escalate, pronoun_fallback)
+
+def generate_triplets_base(text: str, chunk_id=None, abort_on_pronoun: bool = False) -> str:
+    """abort_on_pronoun: smije se prekinuti na prvoj zamjenici samo ako će sigurno ići 2. prolaz."""
+    if FEW_SHOT_MODE == "compare":
+        return compare_prompts(lambda p: call_llm(p, escalate=False), build_base_extraction_prompt, text,
+                               FEW_SHOT_STATS_CSV, chunk_id)
+    abort_on = line_has_pronoun_in_SO if (STREAM_BASE and abort_on_pronoun) else None
+    return call_llm(build_base_extraction_prompt(text), "base", abort_on,
+                    pronoun_fallback=abort_on_pronoun)
 
 def generate_triplets_with_prev_triplets(current_text: str,
-                                         context_triplets: List[str]) -> str:
-    return call_llm(build_context_from_prev_triplets_prompt(current_text, context_triplets))
+                                         context_triplets: List[str],
+                                         label: str = "PRIOR TRIPLETS") -> str:
+    return call_llm(build_context_from_prev_triplets_prompt(current_text, context_triplets, label),
+                    "context", check_pronouns=True)
 
 # ============== Helpers ==============
-def normalize_triplet_line(line: str) -> str:
-    return line.replace('" | "', '"|"').replace('" |"', '"|"').replace('"| "', '"|"')
-
-def is_valid_triplet(parts: List[str]) -> bool:
-    if len(parts) != 3:
-        return False
-    for p in parts:
-        val = p.strip().lower()
-        if val == "" or val == "null":
-            return False
-    return True
-
-def entity_contains_pronoun(entity_text: str) -> bool:
-    tokens = [t.lower() for t in WORD_RE.findall(entity_text)]
-    return any(tok in PRONOUNS for tok in tokens)
-
-def triplets_have_pronoun_in_SO(triplets_text: str) -> bool:
-    for raw in (triplets_text or "").splitlines():
-        line = normalize_triplet_line(raw)
-        parts = line.strip().strip('"').split('"|"')
-        if len(parts) >= 3:
-            s, o = parts[0], parts[2]
-            if entity_contains_pronoun(s) or entity_contains_pronoun(o):
-                return True
-    return False
-
 def get_prev_chunk_ids_same_question(df: pd.DataFrame, idx: int, question_id, k: int = 2) -> List[int]:
     ids = []
     j = idx - 1
@@ -217,43 +152,42 @@ def get_prev_chunk_ids_same_question(df: pd.DataFrame, idx: int, question_id, k:
     return ids
 
 # ============== Main (Method 3) ==============
-def main():
-    os.makedirs(BAD_DIR, exist_ok=True)
-
-    df = pd.read_csv(INPUT_CSV)
+def load_chunks(path: str = INPUT_CSV) -> pd.DataFrame:
+    df = pd.read_csv(path)
+    # stabilan poredak
     if 'chunk_ID' in df.columns:
         df = df.sort_values(by='chunk_ID', ascending=True).reset_index(drop=True)
-
-    # izbjegni dupliranje upisa
-    processed_ids = set()
-    if os.path.isfile(OUTPUT_CSV):
-        try:
-            existing = pd.read_csv(OUTPUT_CSV, delimiter='|', quotechar='"')
-            if 'chunk_ID' in existing.columns:
-                processed_ids = set(existing['chunk_ID'].astype(int).tolist())
-        except Exception as e:
-            print(f"⚠️ Greška pri čitanju postojećih tripleta: {e}")
-
-    file_exists = os.path.isfile(OUTPUT_CSV)
-    bad_exists = os.path.isfile(BAD_CSV)
+    return df
+
+def run(df: pd.DataFrame, output_csv: str = OUTPUT_CSV, bad_csv: str = BAD_CSV,
+        parquet_dir: str = PARQUET_DIR, should_stop=None, start_chunk_id: int = None):
+    """
+    Obradi chunkove iz df (sortiran, reset_index) i upiši triplete.
+    should_stop: opcionalna funkcija; ako vrati True, obrada staje prije sljedećeg chunka.
+    start_chunk_id: donja granica chunk_ID-a (None = START_CHUNK_ID; shard mod daje 0, opseg je shard).
+    """
+    if start_chunk_id is None:
+        start_chunk_id = START_CHUNK_ID
+    # izbjegni dupliranje upisa: journal završenih chunkova, nedovršeni se odsijecaju
+    processed_ids = recover_outputs(OUTPUT_FORMAT, output_csv, bad_csv, parquet_dir)
 
     # cache samo iz ove runde: {chunk_ID: [triplet_line, ...]}
     in_run_triplets: Dict[int, List[str]] = {}
-
-    with open(OUTPUT_CSV, "a", encoding="utf-8", newline="") as good_f, \
-         open(BAD_CSV, "a", encoding="utf-8", newline="") as bad_f:
-
-        good_w = csv.writer(good_f, delimiter='|', quoting=csv.QUOTE_MINIMAL)
-        bad_w = csv.writer(bad_f, delimiter='|', quoting=csv.QUOTE_MINIMAL)
-
-        if not file_exists:
-            good_w.writerow(["chunk_ID", "question_ID", "triplet"])
-        if not bad_exists:
-            bad_w.writerow(["chunk_ID", "question_ID", "bad_triplet"])
-
+    # ili, za CONTEXT_SOURCE == "memory": entiteti po question_ID (ograničeno)
+    memories = QuestionMemories(max_entities=MEMORY_MAX_ENTITIES) if CONTEXT_SOURCE == "memory" else None
+
+    sinks = open_sinks(OUTPUT_FORMAT, output_csv, bad_csv, parquet_dir, method="m3",
+                       dedup=DEDUP, dedup_max_questions=DEDUP_MAX_QUESTIONS,
+                       dedup_max_keys=DEDUP_MAX_KEYS)
+    with GroupCommitWriter(sinks, journal_path(output_csv), WRITER_FLUSH_ROWS,
+                           WRITER_FLUSH_SECONDS) as sink:
         for idx, row in df.iterrows():
+            if should_stop and should_stop():
+                print("⛔ Stopping early (should_stop).")
+                break
+
             chunk_id = int(row['chunk_ID'])
-            if chunk_id < START_CHUNK_ID:
+            if chunk_id < start_chunk_id:
                 continue
             if chunk_id in processed_ids:
                 print(f"⏭️ Skipping already processed chunk {chunk_id}")
@@ -263,11 +197,28 @@ def main():
             text = str(row['chunk'])
             print(f"➡️ Chunk {chunk_id}: base extraction...")
 
-            # 1) baza: samo trenutni chunk
-            base_triplets = generate_triplets_base(text)
+            # 1) baza: samo trenutni chunk; prekid na zamjenici samo ako 2. prolaz ima kontekst
+            #    (inače se baza koristi kao konačni rezultat i mora biti kompletna)
+            if memories:
+                has_context = bool(memories.get(qid).top(MEMORY_TOP_N))
+            else:
+                has_context = any(pid in in_run_triplets
+                                  for pid in get_prev_chunk_ids_same_question(df, idx, qid, k=K_PREV))
+            base_triplets = generate_triplets_base(text, chunk_id, abort_on_pronoun=has_context)
+            parsed = parse_response(base_triplets)
 
             # 2) ako postoji zamjenica u S/O -> prekini bazu i radi 2. prolaz sa kontekstom = tripleti iz prethodna 2 chunka (isključivo iz ove runde)
-            if base_triplets and triplets_have_pronoun_in_SO(base_triplets):
+            if has_pronoun_in_SO(parsed) and memories:
+                entities = memories.get(qid).top(MEMORY_TOP_N)
+                if entities:
+                    print(f"↪️ Pronoun detected. Regenerating with {len(entities)} PRIOR ENTITIES for {chunk_id} ...")
+                    final_triplets = generate_triplets_with_prev_triplets(text, format_entities(entities),
+                                                                          label="PRIOR ENTITIES")
+                    parsed = parse_response(final_triplets)
+                else:
+                    print(f"↪️ Pronoun detected but no remembered entities for this question_ID. Falling back to base for {chunk_id}.")
+                    final_triplets = base_triplets
+            elif has_pronoun_in_SO(parsed):
                 prev_ids = get_prev_chunk_ids_same_question(df, idx, qid, k=K_PREV)
 
                 context_triplets: List[str] = []
@@ -278,6 +229,7 @@ def main():
                 if context_triplets:
                     print(f"↪️ Pronoun detected. Regenerating with PRIOR TRIPLETS from {len(prev_ids)} prev chunk(s) for {chunk_id} ...")
                     final_triplets = generate_triplets_with_prev_triplets(text, context_triplets)
+                    parsed = parse_response(final_triplets)
                 else:
                     print(f"↪️ Pronoun detected but no prior triplets available in this run. Falling back to base for {chunk_id}.")
                     final_triplets = base_triplets
@@ -288,26 +240,38 @@ def main():
             wrote_any = False
             current_good: List[str] = []
 
-            for line in final_triplets.splitlines() if final_triplets else []:
-                clean = normalize_triplet_line(line)
-                parts = clean.strip().strip('"').split('"|"')
-                if is_valid_triplet(parts):
-                    good_w.writerow([chunk_id, qid, line.strip()])
+            for t in parsed:
+                if t.valid:
+                    sink.add_good(chunk_id, qid, t)
                     wrote_any = True
-                    current_good.append(line.strip())
+                    current_good.append(t.raw)
                 else:
-                    bad_w.writerow([chunk_id, qid, line.strip()])
-                    print(f"⚠️ Skipped bad triplet at chunk {chunk_id}: {line.strip()}")
+                    sink.add_bad(chunk_id, qid, t.raw, t.reason)
+                    print(f"⚠️ Skipped bad triplet at chunk {chunk_id}: {t.raw}")
 
             if not wrote_any:
-                bad_w.writerow([chunk_id, qid, (final_triplets or '').strip() or "(empty)"])
+                sink.add_bad(chunk_id, qid, (final_triplets or '').strip() or "(empty)", "no_valid")
                 print(f"⚠️ No valid triplets for chunk {chunk_id}.")
 
-            if current_good:
+            if memories:
+                mem = memories.get(qid)
+                mem.next_chunk()
+                mem.observe_triplets(parsed)
+            elif current_good:
                 in_run_triplets[chunk_id] = current_good
 
+            sink.chunk_done(chunk_id)
+
+    llm.report()
+
+def main():
+    os.makedirs(BAD_DIR, exist_ok=True)
+    run(load_chunks())
+
     print(f"\n✅ Saved good triplets to {OUTPUT_CSV}")
     print(f"✅ Saved bad triplets to {BAD_CSV}")
+    if OUTPUT_FORMAT != "csv":
+        print(f"✅ Saved columnar triplets to {PARQUET_DIR}/good and {PARQUET_DIR}/bad")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,62 @@
+"""
+Sažimanje konteksta (prethodnih chunkova) prije 2. prolaza.
+
+Iz prethodnih chunkova zadržavamo samo rečenice koje mogu nositi antecedent
+(imenovani entiteti: riječi s velikim slovom, akronimi), i to od najnovije
+ka najstarijoj dok ne potrošimo token budžet. Tokeni se procjenjuju
+heuristikom (~4 znaka po tokenu), bez tokenizer zavisnosti.
+"""
+
+import re
+from typing import Dict, List, Tuple
+
+SENT_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+CAP_TOKEN_RE = re.compile(r"\b[A-Z][\w&'’-]*")
+
+# česte riječi s velikim slovom na početku rečenice koje nisu entiteti
+SENT_START_STOP = {
+    "The", "A", "An", "He", "She", "It", "They", "We", "I", "You", "His", "Her",
+    "Its", "Their", "This", "That", "These", "Those", "There", "In", "On", "At",
+    "After", "Before", "When", "While", "As", "But", "And", "However", "Then",
+    "Also", "For", "With", "By", "From", "Although", "Since", "If",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + 3) // 4 if text else 0
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in SENT_SPLIT_RE.split(text or "") if s.strip()]
+
+def has_entity_mention(sentence: str) -> bool:
+    """Rečenica spominje bar jedan kandidat-antecedent (ime, organizaciju, akronim)."""
+    for m in CAP_TOKEN_RE.finditer(sentence):
+        if m.start() > 0 or m.group(0) not in SENT_START_STOP:
+            return True
+    return False
+
+
+def compact_context(prev_chunks: List[str], token_budget: int) -> Tuple[List[str], Dict[str, int]]:
+    """
+    prev_chunks: [stariji, ..., noviji]. Vraća (sažeti chunkovi u istom
+    poretku, bez praznih) i statistiku {"before", "after", "saved"} u tokenima.
+    """
+    before = sum(estimate_tokens(c) for c in prev_chunks)
+
+    kept = [[] for _ in prev_chunks]  # po chunku: (indeks rečenice, rečenica)
+    used = 0
+    for ci in range(len(prev_chunks) - 1, -1, -1):
+        sents = split_sentences(prev_chunks[ci])
+        for si in range(len(sents) - 1, -1, -1):
+            sent = sents[si]
+            if not has_entity_mention(sent):
+                continue
+            cost = estimate_tokens(sent) + 1
+            if used + cost > token_budget:
+                continue
+            kept[ci].append((si, sent))
+            used += cost
+
+    compacted = [" ".join(s for _, s in sorted(k)) for k in kept if k]
+    after = sum(estimate_tokens(c) for c in compacted)
+    return compacted, {"before": before, "after": after, "saved": before - after}
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Brzi renderer za spremljene coref klastere (bez učitavanja modela).
+
+kod.py --clusters-out piše JSONL (jedan red po ulazu):
+    {"id": 0, "text": "...", "clusters": [[[start, end], ...], ...]}
+
+Ovdje se nad tim klasterima primjenjuje politika zamjene, pa jedan
+inference prolaz može hraniti više pogleda.
+
+Pokretanje:
+    python coref_render.py --in clusters.jsonl --policy pronouns
+    python coref_render.py --in clusters.jsonl --policy subject --out resolved.jsonl
+"""
+
+import argparse
+import json
+import re
+import sys
+
+# --------- Zamjenice ---------
+
+SUBJECT_PRONOUNS = {"i", "he", "she", "it", "we", "they", "who"}
+OBJECT_PRONOUNS = {"me", "him", "her", "us", "them", "whom",
+                   "myself", "himself", "herself", "itself", "ourselves",
+                   "themselves", "themself"}
+POSSESSIVE_PRONOUNS = {"my", "mine", "his", "hers", "its", "our", "ours",
+                       "their", "theirs", "whose"}
+PRONOUNS = SUBJECT_PRONOUNS | OBJECT_PRONOUNS | POSSESSIVE_PRONOUNS
+
+# "her" je objekat ili posesiv; posesiv je samo ispred riječi koja nije ovakva
+# funkcijska riječ ("for her report" -> Mary's, "thanked her for" / "her." -> Mary)
+NON_NOUN_WORDS = {
+    "a", "an", "the", "this", "that", "these", "those", "some", "any", "no", "all", "every",
+    "to", "for", "of", "in", "on", "at", "by", "with", "from", "about", "into", "onto", "over",
+    "under", "after", "before", "since", "until", "during", "through", "as", "like", "than",
+    "and", "or", "but", "nor", "so", "yet", "if", "when", "while", "because", "although",
+    "up", "down", "out", "off", "away", "back", "again", "too", "also", "not", "never",
+    "yesterday", "today", "tomorrow", "now", "then", "there", "here", "later", "soon",
+    "once", "twice", "well", "very", "much", "more", "most",
+} | PRONOUNS
+_NEXT_WORD_RE = re.compile(r"\s+([A-Za-z][\w'-]*)")
+
+POLICIES = ("all", "pronouns", "subject")
+
+
+def is_pronoun(mention: str) -> bool:
+    return mention.strip().lower() in PRONOUNS
+
+
+def representative(text: str, cluster: list) -> str:
+    """Prvi mention koji nije zamjenica (inače prvi mention)."""
+    for start, end in cluster:
+        if not is_pronoun(text[start:end]):
+            return text[start:end]
+    start, end = cluster[0]
+    return text[start:end]
+
+
+def _should_replace(mention: str, policy: str) -> bool:
+    low = mention.strip().lower()
+    if policy == "all":
+        return True
+    if policy == "pronouns":
+        return low in PRONOUNS
+    if policy == "subject":
+        return low in SUBJECT_PRONOUNS
+    raise ValueError(f"Nepoznata politika: {policy} (dozvoljeno: {', '.join(POLICIES)})")
+
+
+def _is_possessive(text: str, start: int, end: int) -> bool:
+    low = text[start:end].strip().lower()
+    if low != "her":
+        return low in POSSESSIVE_PRONOUNS
+    m = _NEXT_WORD_RE.match(text, end)  # kraj rečenice/interpunkcija -> objekat
+    return bool(m) and m.group(1).lower() not in NON_NOUN_WORDS
+
+
+def render_clusters(text: str, clusters: list, policy: str = "pronouns") -> str:
+    """
+    Primijeni politiku zamjene nad klasterima i vrati novi tekst.
+    Posesivne zamjenice dobijaju "'s" (his -> John's, "her" samo ispred
+    imenske riječi); preklapajući mentioni se preskaču (zadržava se raniji).
+    """
+    edits = []
+    for cluster in clusters:
+        if len(cluster) < 2:
+            continue
+        rep = representative(text, cluster)
+        for start, end in cluster:
+            mention = text[start:end]
+            if mention == rep or not _should_replace(mention, policy):
+                continue
+            repl = rep + "'s" if _is_possessive(text, start, end) else rep
+            edits.append((start, end, repl))
+
+    edits.sort()
+    out, pos = [], 0
+    for start, end, repl in edits:
+        if start < pos:
+            continue
+        out.append(text[pos:start])
+        out.append(repl)
+        pos = end
+    out.append(text[pos:])
+    return "".join(out)
+
+
+# --------- JSONL ---------
+
+def write_clusters_jsonl(path, records) -> int:
+    """records: iterable (id, text, clusters). Vraća broj zapisanih redova."""
+    n = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for rid, text, clusters in records:
+            f.write(json.dumps({"id": rid, "text": text, "clusters": clusters},
+                               ensure_ascii=False) + "\n")
+            n += 1
+    return n
+
+
+def load_clusters_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+# --------- CLI ---------
+
+def main():
+    ap = argparse.ArgumentParser(description="Render spremljenih coref klastera (bez modela).")
+    ap.add_argument("--in", dest="in_path", type=str, required=True,
+                    help="JSONL s klasterima (izlaz kod.py --clusters-out).")
+    ap.add_argument("--out", dest="out_path", type=str, default=None,
+                    help="Izlazni JSONL {id, resolved} (ako se ne navede, ispisuje tekst na stdout).")
+    ap.add_argument("--policy", choices=POLICIES, default="pronouns",
+                    help="all = svi mentioni, pronouns = samo zamjenice, subject = samo subjektne zamjenice.")
+    args = ap.parse_args()
+
+    rendered = ((rec["id"], render_clusters(rec["text"], rec["clusters"], args.policy))
+                for rec in load_clusters_jsonl(args.in_path))
+
+    if args.out_path:
+        with open(args.out_path, "w", encoding="utf-8") as f:
+            for rid, resolved in rendered:
+                f.write(json.dumps({"id": rid, "resolved": resolved}, ensure_ascii=False) + "\n")
+        print(f"[OK] Sačuvano: {args.out_path}")
+    else:
+        sys.stdout.reconfigure(encoding="utf-8")
+        for _, resolved in rendered:
+            print(resolved)
+
+
+if __name__ == "__main__":
+    main()
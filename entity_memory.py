@@ -0,0 +1,106 @@
+"""
+Memorija entiteta po question_ID (izvor konteksta za 2. prolaz).
+
+Iz izvučenih tripleta pamtimo subjekte i objekte sa salience ocjenom koja
+raste sa frekvencijom i opada sa starošću (decay po chunku). Veličina je
+ograničena: kad se pređe max_entities, izbacuje se entitet sa najmanjim
+salience-om. Prompt dobija samo top-N entiteta, pa je kontekst kratak i
+fiksne veličine, a antecedent iz davno viđenog chunka i dalje može ostati.
+"""
+
+import re
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+
+from triplet_parser import entity_contains_pronoun
+
+_WS_RE = re.compile(r"\s+")
+
+
+def entity_key(name: str) -> str:
+    return _WS_RE.sub(" ", name).strip().strip('"').casefold()
+
+
+class EntityMemory:
+    """Ograničen skup entiteta jednog question_ID-a sa recency/frequency salience-om."""
+
+    __slots__ = ("max_entities", "decay", "step", "_entities")
+
+    def __init__(self, max_entities: int = 64, decay: float = 0.85):
+        self.max_entities = max_entities
+        self.decay = decay
+        self.step = 0
+        # key -> [ocjena u trenutku last_step, last_step, ime za prikaz]
+        self._entities: Dict[str, list] = {}
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+    def _salience(self, rec: list) -> float:
+        score, last_step, _ = rec
+        return score * self.decay ** (self.step - last_step)
+
+    def next_chunk(self):
+        """Pozvati jednom po chunku (stariji spomeni blijede)."""
+        self.step += 1
+
+    def observe(self, names: Iterable[str]):
+        for name in names:
+            name = _WS_RE.sub(" ", name or "").strip().strip('"').strip()
+            # zamjenice i čisti brojevi/datumi nisu korisni antecedenti
+            if not name or entity_contains_pronoun(name) or not any(c.isalpha() for c in name):
+                continue
+            key = entity_key(name)
+            rec = self._entities.get(key)
+            if rec is None:
+                self._entities[key] = [1.0, self.step, name]
+            else:
+                rec[0] = self._salience(rec) + 1.0
+                rec[1] = self.step
+                rec[2] = name
+        if len(self._entities) > self.max_entities:
+            self._evict()
+
+    def observe_triplets(self, triplets: Iterable):
+        """triplets: Triplet zapisi (triplet_parser); uzimaju se subjekt i objekt validnih."""
+        names = []
+        for t in triplets:
+            if t.valid:
+                names.append(t.subject)
+                names.append(t.object)
+        self.observe(names)
+
+    def _evict(self):
+        ranked = sorted(self._entities.items(), key=lambda kv: self._salience(kv[1]))
+        for key, _ in ranked[:len(self._entities) - self.max_entities]:
+            del self._entities[key]
+
+    def top(self, n: int) -> List[str]:
+        ranked = sorted(self._entities.values(), key=self._salience, reverse=True)
+        return [rec[2] for rec in ranked[:n]]
+
+
+class QuestionMemories:
+    """EntityMemory po question_ID; drži se najviše max_questions aktivnih (LRU)."""
+
+    def __init__(self, max_questions: int = 256, max_entities: int = 64, decay: float = 0.85):
+        self.max_questions = max_questions
+        self.max_entities = max_entities
+        self.decay = decay
+        self._by_question: "OrderedDict[object, EntityMemory]" = OrderedDict()
+
+    def get(self, question_id) -> EntityMemory:
+        mem = self._by_question.get(question_id)
+        if mem is None:
+            mem = EntityMemory(self.max_entities, self.decay)
+            self._by_question[question_id] = mem
+            if len(self._by_question) > self.max_questions:
+                self._by_question.popitem(last=False)
+        else:
+            self._by_question.move_to_end(question_id)
+        return mem
+
+
+def format_entities(entities: List[str]) -> List[str]:
+    """Jedan entitet po liniji (najvažniji prvi), u istom navodnik stilu kao tripleti."""
+    return [f'"{e}"' for e in entities]
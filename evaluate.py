@@ -0,0 +1,251 @@
+"""
+Evaluacija metoda (tačnost vs. trošak) nad malim gold setom.
+
+Gold set (eval_gold.jsonl): jedan chunk po liniji,
+    {"chunk_ID": 1, "question_ID": "q_curie", "chunk": "...", "triplets": [["S", "R", "O"], ...]}
+Chunkovi istog question_ID-a čine "nit", pa metode imaju prethodni kontekst.
+
+Svaka metoda se pokreće nad gold setom (svojim run(), u privremenom folderu),
+a njen `co` klijent se zamijeni klijentom koji snima ili reprodukuje odgovore
+(kaseta eval_cassette.jsonl, ključ = model + prompt):
+    record  -> pravi API pozivi, odgovori i latencija se upisuju u kasetu
+    replay  -> bez mreže, deterministički; prompt koji nije snimljen je greška
+Bez kasete replay nema šta da reprodukuje: main() tada odmah prekida sa
+porukom (prvo jednom --mode record, sa API ključem), prije pokretanja metoda.
+
+Metrike po metodi: precision/recall/F1 tripleta (normalizovan S/R/O, po
+chunku), udio tripleta bez zamjenice u S/O, broj LLM poziva, (procijenjeni)
+prompt i output tokeni i vrijeme po chunku. U replay modu "llm_s" je zbir
+snimljenih latencija (za prekinut stream srazmjerno pročitanom dijelu), a
+"wall_s" je samo lokalna obrada.
+
+Pokretanje:
+    python evaluate.py --mode record                 # jednom, sa API ključem
+    python evaluate.py                               # replay, sve tri metode
+    python evaluate.py --methods SecondMethod ThirdMethod --json eval_report.json
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+
+from context_compaction import estimate_tokens
+from triplet_parser import parse_triplet_line
+from triplet_sink import triplet_key
+from work_queue import load_method
+
+GOLD_JSONL = "eval_gold.jsonl"
+CASSETTE_JSONL = "eval_cassette.jsonl"
+METHODS = ["FirstMethod", "SecondMethod", "ThirdMethod"]
+
+
+# ======= Snimanje / reprodukcija LLM odgovora =======
+
+def _prompt_of(messages) -> str:
+    return "\n".join(m["content"] for m in messages)
+
+
+def cassette_key(model: str, prompt: str) -> str:
+    return hashlib.sha1(f"{model}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+class CassetteMiss(KeyError):
+    """Prompt koji nije snimljen u kaseti (replay mod)."""
+
+
+class CassetteClient:
+    """
+    Zamjena za cohere.ClientV2 (chat i chat_stream) koja broji pozive i tokene.
+    U record modu prosljeđuje pozive pravom klijentu (stream se snima kao
+    kompletan odgovor), u replay modu vraća snimljene odgovore.
+    """
+
+    def __init__(self, path: str, mode: str = "replay", real_client=None):
+        if mode == "record" and real_client is None:
+            raise ValueError("record mod traži pravi klijent")
+        self.path = path
+        self.mode = mode
+        self.real = real_client
+        self.responses = {}
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        rec = json.loads(line)
+                        self.responses[rec["key"]] = rec
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.llm_seconds = 0.0
+
+    def _get(self, model: str, prompt: str) -> dict:
+        key = cassette_key(model, prompt)
+        rec = self.responses.get(key)
+        if rec is None:
+            if self.mode != "record":
+                raise CassetteMiss(f"Nema snimljenog odgovora za prompt (key {key[:12]}); pokreni sa --mode record.")
+            from llm_client import chat
+            t0 = time.perf_counter()
+            text = chat(self.real, model, prompt)
+            rec = {"key": key, "model": model, "response": text,
+                   "seconds": round(time.perf_counter() - t0, 3)}
+            self.responses[key] = rec
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self.calls += 1
+        self.prompt_tokens += estimate_tokens(prompt)
+        return rec
+
+    def chat(self, model, messages, **kwargs):
+        rec = self._get(model, _prompt_of(messages))
+        self.output_tokens += estimate_tokens(rec["response"])
+        self.llm_seconds += rec["seconds"]
+        item = SimpleNamespace(type="text", text=rec["response"])
+        return SimpleNamespace(message=SimpleNamespace(content=[item]))
+
+    def chat_stream(self, model, messages, **kwargs):
+        rec = self._get(model, _prompt_of(messages))
+        text = rec["response"]
+
+        def events():
+            sent = 0
+            try:
+                for line in text.splitlines(keepends=True):
+                    sent += len(line)
+                    yield SimpleNamespace(type="content-delta", delta=SimpleNamespace(
+                        message=SimpleNamespace(content=SimpleNamespace(text=line))))
+            finally:
+                # plaća se (i traje) samo ono što je pročitano prije prekida
+                self.output_tokens += estimate_tokens(text[:sent])
+                self.llm_seconds += rec["seconds"] * (sent / len(text) if text else 1.0)
+
+        return events()
+
+
+# ======= Gold set i metrike =======
+
+def load_gold(path: str = GOLD_JSONL):
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                rows.append(json.loads(line))
+    df = pd.DataFrame([{"chunk_ID": r["chunk_ID"], "question_ID": r["question_ID"], "chunk": r["chunk"]}
+                       for r in rows])
+    df = df.sort_values(by="chunk_ID", ascending=True).reset_index(drop=True)
+    gold = {int(r["chunk_ID"]): {triplet_key(parse_triplet_line('"' + '"|"'.join(t) + '"'))
+                                 for t in r["triplets"]} for r in rows}
+    return df, gold
+
+
+def read_predictions(output_csv: str) -> dict:
+    pred = {}
+    if not os.path.isfile(output_csv):
+        return pred
+    with open(output_csv, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f, delimiter="|"):
+            t = parse_triplet_line(row["triplet"])
+            if t.valid:
+                pred.setdefault(int(row["chunk_ID"]), []).append(t)
+    return pred
+
+
+def score(gold: dict, pred: dict) -> dict:
+    tp = n_pred = n_gold = n_pron_free = 0
+    for chunk_id, gold_keys in gold.items():
+        triplets = pred.get(chunk_id, [])
+        keys = {triplet_key(t) for t in triplets}
+        tp += len(keys & gold_keys)
+        n_pred += len(keys)
+        n_gold += len(gold_keys)
+        n_pron_free += sum(1 for t in triplets if not t.has_pronoun)
+    n_lines = sum(len(pred.get(c, [])) for c in gold)
+    precision = tp / n_pred if n_pred else 0.0
+    recall = tp / n_gold if n_gold else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1,
+            "pronoun_free": n_pron_free / n_lines if n_lines else 1.0}
+
+
+# ======= Pokretanje =======
+
+def evaluate_method(name: str, df: pd.DataFrame, gold: dict, client: CassetteClient) -> dict:
+    method = load_method(name)
+    method.co = client
+    method.OUTPUT_FORMAT = "csv"
+    client.reset_stats()
+
+    with tempfile.TemporaryDirectory(prefix=f"eval_{name}_") as tmp:
+        output_csv = os.path.join(tmp, "triplets.csv")
+        t0 = time.perf_counter()
+        method.run(df, output_csv=output_csv, bad_csv=os.path.join(tmp, "bad.csv"),
+                   parquet_dir=os.path.join(tmp, "parquet"), start_chunk_id=0)
+        wall = time.perf_counter() - t0
+        pred = read_predictions(output_csv)
+
+    n = len(df)
+    result = {"method": name, "chunks": n}
+    result.update(score(gold, pred))
+    result.update({
+        "calls_per_chunk": client.calls / n,
+        "prompt_tokens_per_chunk": client.prompt_tokens / n,
+        "output_tokens_per_chunk": client.output_tokens / n,
+        "llm_s_per_chunk": client.llm_seconds / n,
+        "wall_s_per_chunk": wall / n,
+    })
+    return result
+
+
+def print_report(results: list):
+    print(f"\n{'method':<13} {'P':>6} {'R':>6} {'F1':>6} {'pron-free':>9} {'calls':>6} "
+          f"{'prompt_tok':>10} {'output_tok':>10} {'llm_s':>7} {'wall_s':>7}   (po chunku)")
+    for r in results:
+        print(f"{r['method']:<13} {r['precision']:>6.3f} {r['recall']:>6.3f} {r['f1']:>6.3f} "
+              f"{r['pronoun_free']:>9.3f} {r['calls_per_chunk']:>6.2f} {r['prompt_tokens_per_chunk']:>10.0f} "
+              f"{r['output_tokens_per_chunk']:>10.0f} {r['llm_s_per_chunk']:>7.2f} {r['wall_s_per_chunk']:>7.3f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Tačnost vs. trošak metoda nad gold setom (record/replay LLM odgovora).")
+    ap.add_argument("--methods", nargs="+", default=METHODS, choices=METHODS)
+    ap.add_argument("--gold", default=GOLD_JSONL)
+    ap.add_argument("--cassette", default=CASSETTE_JSONL)
+    ap.add_argument("--mode", default="replay", choices=["replay", "record"])
+    ap.add_argument("--json", default=None, help="Upiši rezultate i u JSON fajl.")
+    args = ap.parse_args()
+
+    if args.mode == "replay" and not CassetteClient(args.cassette).responses:
+        raise SystemExit(f"⚠️ No recorded responses in {args.cassette}; run once with --mode record "
+                         f"(needs an API key) to create it.")
+
+    df, gold = load_gold(args.gold)
+    results = []
+    for name in args.methods:
+        print(f"🧪 Evaluating {name} on {len(df)} gold chunk(s) ({args.mode})...")
+        real = load_method(name).co if args.mode == "record" else None
+        client = CassetteClient(args.cassette, args.mode, real)
+        try:
+            results.append(evaluate_method(name, df, gold, client))
+        except CassetteMiss:
+            raise SystemExit(f"⚠️ {args.cassette} has no response for some {name} prompt(s) (prompts or "
+                             f"models changed since recording); re-run with --mode record.")
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved report to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
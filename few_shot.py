@@ -0,0 +1,186 @@
+"""
+Few-shot primjeri za prompte za ekstrakciju tripleta.
+
+"full" daje svih šest primjera (kao do sada). "adaptive" bira nekoliko primjera
+po jeftinim leksičkim osobinama chunka (liste, datumi, organizacije, osobe,
+dužina) unutar token budžeta. "compare" je mjerni mod: isti chunk ide kroz
+puni i adaptivni prompt, a prinos i stopa validnih tripleta se upisuju u CSV,
+dok pipeline i dalje koristi rezultat punog prompta.
+"""
+
+import csv
+import os
+import re
+import time
+from typing import Dict, List
+
+from context_compaction import estimate_tokens
+from triplet_parser import parse_response
+
+FEW_SHOT_MODES = ("full", "adaptive", "compare")
+
+EXAMPLES = [
+    {
+        "input": "Albert Einstein developed the theory of relativity while working in Switzerland.",
+        "outputs": [
+            '"Albert Einstein"|"developed"|"theory of relativity"',
+            '"Albert Einstein"|"worked in"|"Switzerland"',
+        ],
+        "tags": {"person", "location"},
+    },
+    {
+        "input": "The Eiffel Tower in Paris was designed by Gustave Eiffel and completed in 1889.",
+        "outputs": [
+            '"Eiffel Tower"|"located"|"Paris"',
+            '"Eiffel Tower"|"designed by"|"Gustave Eiffel"',
+            '"Eiffel Tower"|"completed"|"1889"',
+        ],
+        "tags": {"location", "person", "date"},
+    },
+    {
+        "input": "Barack Obama served as the 44th president of the United States from 2009 to 2017.",
+        "outputs": [
+            '"Barack Obama"|"served as"|"44th president"',
+            '"Barack Obama"|"president of"|"United States"',
+            '"Barack Obama"|"served from"|"2009"',
+            '"Barack Obama"|"served until"|"2017"',
+        ],
+        "tags": {"person", "date", "location"},
+    },
+    {
+        "input": "Roberts & Vinter came under financial pressure after their printer went bankrupt.",
+        "outputs": [
+            '"Roberts & Vinter"|"came under"|"financial pressure"',
+            '"Roberts & Vinter"|"impacted by"|"printer bankruptcy"',
+        ],
+        "tags": {"organization", "pronoun"},
+    },
+    {
+        "input": "FBI Mortgage Fraud Department came into existence.",
+        "outputs": [
+            '"FBI Mortgage Fraud Department"|"came into"|"existence"',
+        ],
+        "tags": {"organization", "short"},
+    },
+    {
+        "input": 'Tyler Bates worked with films like "Dawn of the Dead, 300, Sucker Punch," and "John Wick." '
+                 "He has collaborated with directors like Zack Snyder, Rob Zombie, Neil Marshall, "
+                 "William Friedkin, Scott Derrickson, and James Gunn.",
+        "outputs": [
+            '"Tyler Bates"|"known for film"|"Dawn of the Dead"',
+            '"Tyler Bates"|"known for film"|"300"',
+            '"Tyler Bates"|"known for film"|"Sucker Punch"',
+            '"Tyler Bates"|"known for film"|"John Wick"',
+            '"Tyler Bates"|"collaborated with"|"Zack Snyder"',
+            '"Tyler Bates"|"collaborated with"|"Rob Zombie"',
+            '"Tyler Bates"|"collaborated with"|"Neil Marshall"',
+            '"Tyler Bates"|"collaborated with"|"William Friedkin"',
+            '"Tyler Bates"|"collaborated with"|"Scott Derrickson"',
+            '"Tyler Bates"|"collaborated with"|"James Gunn"',
+        ],
+        "tags": {"list", "person", "pronoun", "long"},
+    },
+]
+
+YEAR_RE = re.compile(r"\b(1[5-9]\d\d|20\d\d)\b")
+MONTH_RE = re.compile(r"\b(January|February|March|April|May|June|July|August|September|"
+                      r"October|November|December)\b")
+ACRONYM_RE = re.compile(r"\b[A-Z]{2,}\b")
+ORG_RE = re.compile(r"\b(Inc|Corp|Corporation|Company|Ltd|LLC|Department|University|"
+                    r"Agency|Association|Institute|Records|Group|Bank|Party|Council|Band)\b|&")
+PERSON_RE = re.compile(r"\b[A-Z][a-z]+ [A-Z][a-z]+\b")
+LOCATION_RE = re.compile(r"\b(in|at|from|near) [A-Z][a-z]+")
+PRONOUN_RE = re.compile(r"\b(he|she|they|it|his|her|their|its)\b", re.IGNORECASE)
+
+
+def chunk_features(text: str) -> set:
+    feats = set()
+    if any(s.count(",") >= 3 for s in re.split(r"(?<=[.!?])\s+", text)):
+        feats.add("list")
+    if YEAR_RE.search(text) or MONTH_RE.search(text):
+        feats.add("date")
+    if ACRONYM_RE.search(text) or ORG_RE.search(text):
+        feats.add("organization")
+    if PERSON_RE.search(text):
+        feats.add("person")
+    if LOCATION_RE.search(text):
+        feats.add("location")
+    if PRONOUN_RE.search(text):
+        feats.add("pronoun")
+    if len(text) < 200:
+        feats.add("short")
+    elif len(text) > 800:
+        feats.add("long")
+    return feats
+
+
+def render_examples(examples: List[dict]) -> str:
+    blocks = []
+    for i, ex in enumerate(examples, 1):
+        blocks.append(f"Example {i}:\nInput: {ex['input']}\nOutputs:\n" + "\n".join(ex["outputs"]))
+    return "\n\n".join(blocks)
+
+
+def select_examples(text: str, max_examples: int = 2, token_budget: int = 250) -> List[dict]:
+    """
+    Primjeri sa najviše zajedničkih osobina sa chunkom (u originalnom poretku
+    kod izjednačenja), dok ne pređemo max_examples ili token_budget. Bar jedan
+    primjer uvijek ide (format mora biti pokazan).
+    """
+    feats = chunk_features(text)
+    ranked = sorted(range(len(EXAMPLES)), key=lambda i: (-len(EXAMPLES[i]["tags"] & feats), i))
+    chosen, used = [], 0
+    for i in ranked:
+        cost = estimate_tokens(render_examples([EXAMPLES[i]]))
+        if chosen and (len(chosen) >= max_examples or used + cost > token_budget):
+            continue
+        chosen.append(i)
+        used += cost
+    return [EXAMPLES[i] for i in sorted(chosen)]
+
+
+def examples_block(text: str, mode: str = "full", max_examples: int = 2,
+                   token_budget: int = 250) -> str:
+    if mode not in FEW_SHOT_MODES:
+        raise ValueError(f"FEW_SHOT_MODE mora biti jedan od {FEW_SHOT_MODES}, dobijeno: {mode}")
+    if mode == "adaptive":
+        return render_examples(select_examples(text, max_examples, token_budget))
+    return render_examples(EXAMPLES)
+
+
+def _yield_stats(output: str) -> Dict[str, float]:
+    parsed = [t for t in parse_response(output) if t.raw]
+    n_valid = sum(1 for t in parsed if t.valid)
+    return {"lines": len(parsed), "valid": n_valid,
+            "valid_rate": round(n_valid / len(parsed), 3) if parsed else 0.0}
+
+
+def compare_prompts(call_llm, build_prompt, text: str, stats_csv: str, chunk_id=None,
+                    pass_name: str = "base") -> str:
+    """
+    Mjerni mod: build_prompt(text, few_shot=...) se poziva za "full" i "adaptive",
+    oba odgovora se mjere i upisuju u stats_csv. Vraća izlaz punog prompta.
+    pass_name: koji prolaz je mjeren (npr. "base" ili "rewritten" u 1. metodi).
+    call_llm mora biti jedan poziv bez eskalacije na drugi model, inače mjerenje
+    ne opisuje prompt nego eskalirani izlaz.
+    """
+    row = {"chunk_ID": chunk_id, "pass": pass_name, "features": "+".join(sorted(chunk_features(text)))}
+    outputs = {}
+    for mode in ("full", "adaptive"):
+        prompt = build_prompt(text, few_shot=mode)
+        t0 = time.perf_counter()
+        outputs[mode] = call_llm(prompt)
+        row[f"{mode}_seconds"] = round(time.perf_counter() - t0, 3)
+        row[f"{mode}_prompt_tokens"] = estimate_tokens(prompt)
+        for k, v in _yield_stats(outputs[mode]).items():
+            row[f"{mode}_{k}"] = v
+
+    exists = os.path.isfile(stats_csv)
+    with open(stats_csv, "a", encoding="utf-8", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=list(row))
+        if not exists:
+            w.writeheader()
+        w.writerow(row)
+    print(f"📏 Few-shot compare for {chunk_id} ({pass_name}): prompt ~{row['full_prompt_tokens']} -> ~{row['adaptive_prompt_tokens']} tokens, "
+          f"valid {row['full_valid']} vs {row['adaptive_valid']}")
+    return outputs["full"]
@@ -12,20 +12,47 @@ Pokretanje:
 
     # 2) Obradi vlastiti .txt fajl:
     python coref_resolve_cpu.py --in input.txt --out output.txt
+
+    # 3) Samo klasteri (JSONL s char offsetima), pa render bez modela:
+    python coref_resolve_cpu.py --in input.txt --clusters-out clusters.jsonl
+    python coref_render.py --in clusters.jsonl --policy subject
+
+    # 4) Izbor modela: fast / accurate / auto (po dužini ili latency budžetu)
+    python coref_resolve_cpu.py --in input.txt --model auto --auto-cutoff-chars 1500 --timings
+
+    # 5) Profil po fazama (load, segment, infer, stitch) + peak RSS
+    python coref_resolve_cpu.py --in input.txt --profile --profile-json prof.json --profile-cprofile infer.prof
+
+Kao biblioteka (pipeline-ovi se učitaju jednom, ulazi idu u batchevima):
+    resolver = CorefResolver(max_chars=4000, overlap_sents=2)
+    for resolved in resolver.resolve_many(texts):
+        ...
 """
 
 import argparse
+import cProfile
+import json
 import sys
+import time
+from contextlib import contextmanager
 from pathlib import Path
 import spacy
 
 # >>> KLJUČNI IMPORT: registruje spaCy factory pod imenom "fastcoref"
 from fastcoref import spacy_component  # noqa: F401  (samo zbog side-effect registracije)
 
+from coref_render import write_clusters_jsonl
+
 # --------- NLP pipeline ---------
 
-def build_nlp():
-    """Gradi spaCy pipeline s fastcoref komponentom (CPU default)."""
+# fastcoref modeli: "fast" = F-Coref (brz, default), "accurate" = LingMess (sporiji, tačniji)
+COREF_MODELS = {
+    "fast": {"model_architecture": "FCoref", "model_path": "biu-nlp/f-coref"},
+    "accurate": {"model_architecture": "LingMessCoref", "model_path": "biu-nlp/lingmess-coref"},
+}
+
+def build_nlp(model: str = "fast", device: str = "cpu"):
+    """Gradi spaCy pipeline s fastcoref komponentom (CPU default, model iz COREF_MODELS)."""
     try:
         nlp = spacy.load("en_core_web_sm", exclude=["parser", "lemmatizer", "ner", "textcat"])
     except OSError:
@@ -38,11 +65,315 @@ def build_nlp():
 
     if "fastcoref" not in nlp.pipe_names:
         # nakon importa iznad, factory "fastcoref" postoji
-        nlp.add_pipe("fastcoref")
+        nlp.add_pipe("fastcoref", config={**COREF_MODELS[model], "device": device})
 
     return nlp
 
 
+# --------- Sentencizer ---------
+
+def build_sentencizer():
+    """Lagani blank pipeline samo za podjelu na rečenice (gradi se jednom po resolveru)."""
+    ssplit = spacy.blank("en")
+    ssplit.add_pipe("sentencizer")
+    return ssplit
+
+
+# --------- Profiler po fazama ---------
+
+def peak_rss_mb():
+    """Vršna RSS memorija procesa u MB (None ako platforma to ne nudi)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux daje KB, macOS bajte
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class StageProfiler:
+    """
+    Wall time i broj poziva po imenovanoj fazi (load, segment, infer, stitch).
+    Kad je isključen, stage() ne mjeri ništa. Opcionalno vrti cProfile samo
+    unutar jedne faze (cprofile_stage, npr. "infer").
+    """
+
+    def __init__(self, enabled: bool = False, cprofile_stage: str = None):
+        self.enabled = enabled
+        self.cprofile_stage = cprofile_stage
+        self._cprof = cProfile.Profile() if enabled and cprofile_stage else None
+        # {stage: {"calls": n, "seconds": s}}
+        self.stats = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        prof = self._cprof if name == self.cprofile_stage else None
+        if prof:
+            prof.enable()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            if prof:
+                prof.disable()
+            st = self.stats.setdefault(name, {"calls": 0, "seconds": 0.0})
+            st["calls"] += 1
+            st["seconds"] += dt
+
+    def to_dict(self) -> dict:
+        return {"stages": self.stats, "peak_rss_mb": peak_rss_mb()}
+
+    def table(self) -> str:
+        total = self.stats.get("total", {}).get("seconds") \
+            or sum(st["seconds"] for st in self.stats.values()) or 1.0
+        lines = [f"{'stage':<10}{'calls':>8}{'seconds':>10}{'%':>7}"]
+        for name, st in sorted(self.stats.items(), key=lambda kv: -kv[1]["seconds"]):
+            lines.append(f"{name:<10}{st['calls']:>8}{st['seconds']:>10.3f}{100 * st['seconds'] / total:>7.1f}")
+        rss = peak_rss_mb()
+        lines.append(f"peak RSS: {rss:.1f} MB" if rss is not None else "peak RSS: n/a")
+        return "\n".join(lines)
+
+    def dump_cprofile(self, path: str):
+        if self._cprof:
+            self._cprof.dump_stats(path)
+
+
+# --------- Resolver (jednom učitan, višekratno korišten) ---------
+
+class CorefResolver:
+    """
+    Drži učitane pipeline-ove (nlp s fastcoref + sentencizer) i nudi batch API.
+
+    Kratki tekstovi (<= max_chars) idu zajedno kroz nlp.pipe, a dugi se
+    automatski dijele u prozore s preklapanjem i spajaju nazad.
+
+    model: "fast", "accurate" ili "auto". Kod "auto" se model bira po ulazu:
+    ako je zadan latency_budget (sekunde) i već imamo izmjerenu propusnost
+    accurate modela, bira se accurate kad procjena stane u budžet; inače
+    accurate za tekstove <= auto_cutoff_chars, fast za duže (korpus).
+    Pipeline-ovi se grade lijeno, po jedan po modelu.
+
+    profiler: StageProfiler za mjerenje faza (default isključen).
+    """
+
+    def __init__(self, max_chars: int = 4000, overlap_sents: int = 2,
+                 batch_size: int = 8, nlp=None, model: str = "fast",
+                 auto_cutoff_chars: int = 1500, latency_budget: float = None,
+                 profiler: StageProfiler = None):
+        if model != "auto" and model not in COREF_MODELS:
+            raise ValueError(f"Nepoznat model: {model} (dozvoljeno: auto, {', '.join(COREF_MODELS)})")
+        self.max_chars = max_chars
+        self.overlap_sents = overlap_sents
+        self.batch_size = batch_size
+        self.model = model
+        self.auto_cutoff_chars = auto_cutoff_chars
+        self.latency_budget = latency_budget
+        self.profiler = profiler or StageProfiler()
+        self._nlps = {}
+        if nlp is not None:
+            self._nlps["fast" if model == "auto" else model] = nlp
+        with self.profiler.stage("load"):
+            self.ssplit = build_sentencizer()
+        # {model: {"docs": n, "chars": n, "seconds": s}}
+        self.timings = {}
+
+    # --- izbor modela ---
+
+    def nlp_for(self, model: str):
+        if model not in self._nlps:
+            with self.profiler.stage("load"):
+                self._nlps[model] = build_nlp(model)
+        return self._nlps[model]
+
+    def choose_model(self, n_chars: int) -> str:
+        if self.model != "auto":
+            return self.model
+        acc = self.timings.get("accurate")
+        if self.latency_budget is not None and acc and acc["seconds"] > 0:
+            est = n_chars / (acc["chars"] / acc["seconds"])
+            return "accurate" if est <= self.latency_budget else "fast"
+        return "accurate" if n_chars <= self.auto_cutoff_chars else "fast"
+
+    def timing_report(self) -> str:
+        lines = [f"{'model':<10}{'docs':>8}{'chars':>12}{'seconds':>10}{'ms/doc':>10}{'chars/s':>12}"]
+        for model, t in sorted(self.timings.items()):
+            ms_doc = 1000 * t["seconds"] / t["docs"] if t["docs"] else 0.0
+            cps = t["chars"] / t["seconds"] if t["seconds"] else 0.0
+            lines.append(f"{model:<10}{t['docs']:>8}{t['chars']:>12}{t['seconds']:>10.2f}{ms_doc:>10.1f}{cps:>12.0f}")
+        return "\n".join(lines)
+
+    def count_sents(self, text: str) -> int:
+        with self.profiler.stage("segment"):
+            return sum(1 for _ in self.ssplit(text).sents)
+
+    def window_spans(self, text: str) -> list:
+        """
+        Prozori (~max_chars) po rečenicama uz preklapanje od overlap_sents,
+        kao (start_char, end_char) u originalnom tekstu.
+        """
+        sents = []
+        with self.profiler.stage("segment"):
+            for s in self.ssplit(text).sents:
+                stripped = s.text.strip()
+                if stripped:
+                    start = s.start_char + s.text.index(stripped)
+                    sents.append((start, start + len(stripped)))
+
+        chunks, cur, total = [], [], 0
+        for start, end in sents:
+            s_len = end - start + 1
+            if cur and total + s_len > self.max_chars:
+                chunks.append(cur[:])
+                cur = cur[-self.overlap_sents:] if self.overlap_sents > 0 else []
+                total = sum(e - b + 1 for b, e in cur)
+            cur.append((start, end))
+            total += s_len
+        if cur:
+            chunks.append(cur)
+        return [(c[0][0], c[-1][1]) for c in chunks]
+
+    def windows(self, text: str) -> list:
+        return [text[a:b] for a, b in self.window_spans(text)]
+
+    def _pipe(self, texts, model: str, resolve: bool = True):
+        """nlp.pipe uz mjerenje vremena po modelu (samo vrijeme unutar pipe-a)."""
+        t = self.timings.setdefault(model, {"docs": 0, "chars": 0, "seconds": 0.0})
+        docs = self.nlp_for(model).pipe(texts, batch_size=self.batch_size,
+                                        component_cfg={"fastcoref": {"resolve_text": resolve}})
+        while True:
+            t0 = time.perf_counter()
+            with self.profiler.stage("infer"):
+                doc = next(docs, None)
+            t["seconds"] += time.perf_counter() - t0
+            if doc is None:
+                return
+            t["docs"] += 1
+            t["chars"] += len(doc.text)
+            yield doc
+
+    def _stitch(self, resolved_windows: list) -> str:
+        with self.profiler.stage("stitch"):
+            resolved_parts = []
+            for i, resolved in enumerate(resolved_windows):
+                rsents = [s.text for s in self.ssplit(resolved).sents]
+                if i > 0 and self.overlap_sents > 0:
+                    rsents = rsents[self.overlap_sents:]
+                resolved_parts.append(" ".join(rsents))
+            return " ".join(resolved_parts).strip()
+
+    def _map_many(self, texts, on_doc, on_long, resolve: bool):
+        """
+        Zajednička petlja za *_many: kratki tekstovi se skupljaju u batch za
+        nlp.pipe; dugi tekst prvo isprazni tekući batch (zbog redoslijeda),
+        pa ide kroz on_long (prozori).
+        """
+        batch, batch_model = [], None
+        for text in texts:
+            model = self.choose_model(len(text))
+            if len(text) > self.max_chars:
+                yield from self._flush(batch, batch_model, on_doc, resolve)
+                batch = []
+                yield on_long(text, model)
+                continue
+            if batch and model != batch_model:
+                yield from self._flush(batch, batch_model, on_doc, resolve)
+                batch = []
+            batch.append(text)
+            batch_model = model
+            if len(batch) >= self.batch_size:
+                yield from self._flush(batch, batch_model, on_doc, resolve)
+                batch = []
+        yield from self._flush(batch, batch_model, on_doc, resolve)
+
+    def _flush(self, batch, model, on_doc, resolve: bool):
+        if batch:
+            for doc in self._pipe(batch, model, resolve=resolve):
+                yield on_doc(doc)
+
+    # --- razriješen tekst ---
+
+    def resolve(self, text: str) -> str:
+        return next(self.resolve_many([text]))
+
+    def resolve_long(self, text: str, model: str = None) -> str:
+        """Uvijek kroz prozore (za tekstove duže od max_chars)."""
+        model = model or self.choose_model(len(text))
+        docs = self._pipe(self.windows(text), model)
+        return self._stitch([doc._.resolved_text for doc in docs])
+
+    def resolve_many(self, texts):
+        """Generator razriješenih tekstova, istim redoslijedom kao ulaz."""
+        return self._map_many(texts, lambda doc: doc._.resolved_text,
+                              self.resolve_long, resolve=True)
+
+    # --- klasteri (offseti u znakovima) ---
+
+    @staticmethod
+    def _doc_clusters(doc, offset: int = 0) -> list:
+        return [[[start + offset, end + offset] for start, end in cluster]
+                for cluster in doc._.coref_clusters]
+
+    def clusters_long(self, text: str, model: str = None) -> list:
+        """
+        Klasteri dugog teksta: svaki prozor se rješava posebno, offseti se
+        pomjere u koordinate cijelog teksta, a klasteri koji dijele isti
+        mention (iz preklapanja) se spajaju.
+        """
+        model = model or self.choose_model(len(text))
+        spans = self.window_spans(text)
+        docs = self._pipe([text[a:b] for a, b in spans], model, resolve=False)
+        clusters = []
+        for (start, _), doc in zip(spans, docs):
+            clusters.extend(self._doc_clusters(doc, offset=start))
+        with self.profiler.stage("stitch"):
+            return merge_clusters(clusters)
+
+    def clusters_many(self, texts):
+        """
+        Generator klastera po ulazu: lista klastera, svaki klaster je lista
+        [start_char, end_char] mentiona. Bez resolved_text (jeftinije).
+        """
+        return self._map_many(texts, self._doc_clusters,
+                              self.clusters_long, resolve=False)
+
+
+def merge_clusters(clusters: list) -> list:
+    """Spoji klastere koji dijele barem jedan identičan mention (union-find)."""
+    parent = list(range(len(clusters)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    owner = {}
+    for ci, cluster in enumerate(clusters):
+        for start, end in cluster:
+            key = (start, end)
+            if key in owner:
+                parent[find(ci)] = find(owner[key])
+            else:
+                owner[key] = ci
+
+    groups = {}
+    for ci, cluster in enumerate(clusters):
+        groups.setdefault(find(ci), set()).update((s, e) for s, e in cluster)
+
+    merged = [sorted(g) for g in groups.values()]
+    merged.sort(key=lambda c: c[0])
+    return [[[s, e] for s, e in c] for c in merged]
+
+
 # --------- Rješavanje za kraće tekstove ---------
 
 def resolve_text(text: str, nlp=None) -> str:
@@ -57,39 +388,15 @@ def resolve_text(text: str, nlp=None) -> str:
 
 # --------- Chunking s preklapanjem za duge tekstove ---------
 
-def chunk_and_resolve(text: str, max_chars: int = 4000, overlap_sents: int = 2) -> str:
+def chunk_and_resolve(text: str, max_chars: int = 4000, overlap_sents: int = 2,
+                      nlp=None) -> str:
     """
     Dijeli tekst u prozore (~max_chars) po rečenicama uz preklapanje od overlap_sents.
     Svaki prozor se rješava, a rezultati se spajaju.
+    Za više poziva zaredom koristi CorefResolver (nlp i sentencizer se grade jednom).
     """
-    ssplit = spacy.blank("en")
-    ssplit.add_pipe("sentencizer")
-    sents = [s.text.strip() for s in ssplit(text).sents if s.text.strip()]
-
-    chunks, cur, total = [], [], 0
-    for s in sents:
-        s_len = len(s) + 1
-        if cur and total + s_len > max_chars:
-            chunks.append(cur[:])
-            cur = cur[-overlap_sents:] if overlap_sents > 0 else []
-            total = sum(len(x) + 1 for x in cur)
-        cur.append(s)
-        total += s_len
-    if cur:
-        chunks.append(cur)
-
-    nlp = build_nlp()
-    docs = nlp.pipe([" ".join(c) for c in chunks],
-                    component_cfg={"fastcoref": {"resolve_text": True}})
-
-    resolved_parts = []
-    for i, doc in enumerate(docs):
-        rsents = [s.text for s in ssplit(doc._.resolved_text).sents]
-        if i > 0 and overlap_sents > 0:
-            rsents = rsents[overlap_sents:]
-        resolved_parts.append(" ".join(rsents))
-
-    return " ".join(resolved_parts).strip()
+    resolver = CorefResolver(max_chars=max_chars, overlap_sents=overlap_sents, nlp=nlp)
+    return resolver.resolve_long(text)
 
 
 # --------- Primjeri za test ---------
@@ -110,22 +417,21 @@ def get_examples():
     ]
 
 
-def count_sents(text: str) -> int:
+def count_sents(text: str, ssplit=None) -> int:
     """Pomoćna: prebroji rečenice radi lijepog zaglavlja po primjeru."""
-    ssplit = spacy.blank("en")
-    ssplit.add_pipe("sentencizer")
+    ssplit = ssplit or build_sentencizer()
     return sum(1 for _ in ssplit(text).sents)
 
 
-def print_examples_pretty(examples):
+def print_examples_pretty(examples, resolver=None):
     """Lijepi, čitki ispis: Original vs Resolved za svaki primjer."""
     sys.stdout.reconfigure(encoding="utf-8")
-    nlp = build_nlp()
+    resolver = resolver or CorefResolver()
 
     bar = "─" * 80
-    for i, ex in enumerate(examples, 1):
-        resolved = resolve_text(ex, nlp=nlp) if len(ex) <= 4000 else chunk_and_resolve(ex)
-        n_sents = count_sents(ex)
+    resolved_all = resolver.resolve_many(examples)
+    for i, (ex, resolved) in enumerate(zip(examples, resolved_all), 1):
+        n_sents = resolver.count_sents(ex)
         print(f"\n{bar}")
         print(f"Example {i}  •  {n_sents} sentence(s)")
         print(f"{bar}")
@@ -148,16 +454,73 @@ def main():
                     help="Maksimalna veličina prozora u znakovima (default 4000).")
     ap.add_argument("--overlap-sents", type=int, default=2,
                     help="Broj rečenica preklapanja (default 2).")
+    ap.add_argument("--batch-size", type=int, default=8,
+                    help="Broj kratkih tekstova po nlp.pipe batchu (default 8).")
+    ap.add_argument("--model", choices=["auto", *COREF_MODELS], default="fast",
+                    help="fastcoref model: fast (F-Coref), accurate (LingMess) ili auto po dužini ulaza.")
+    ap.add_argument("--auto-cutoff-chars", type=int, default=1500,
+                    help="Kod --model auto: accurate do ove dužine, fast iznad (default 1500).")
+    ap.add_argument("--latency-budget", type=float, default=None,
+                    help="Kod --model auto: budžet u sekundama po ulazu; accurate ako procjena stane.")
+    ap.add_argument("--timings", action="store_true",
+                    help="Na kraju ispiši vrijeme po modelu na stderr (za podešavanje cutoff-a).")
+    ap.add_argument("--profile", action="store_true",
+                    help="Mjeri faze (load, segment, infer, stitch) i peak RSS; tabela + JSON na stderr.")
+    ap.add_argument("--profile-json", type=str, default=None,
+                    help="Uz --profile: JSON izvještaj u fajl umjesto na stderr.")
+    ap.add_argument("--profile-cprofile", type=str, default=None,
+                    help="Uz --profile: cProfile dump (.prof) samo za infer fazu.")
+    ap.add_argument("--clusters-out", type=str, default=None,
+                    help="Umjesto razriješenog teksta upiši klastere (char offseti) u JSONL; "
+                         "render bez modela: python coref_render.py --in <jsonl>.")
     args = ap.parse_args()
 
+    profiler = StageProfiler(enabled=args.profile,
+                             cprofile_stage="infer" if args.profile_cprofile else None)
+    resolver = CorefResolver(max_chars=args.max_chars, overlap_sents=args.overlap_sents,
+                             batch_size=args.batch_size, model=args.model,
+                             auto_cutoff_chars=args.auto_cutoff_chars,
+                             latency_budget=args.latency_budget,
+                             profiler=profiler)
+    try:
+        with profiler.stage("total"):
+            run(args, resolver)
+    finally:
+        if args.timings:
+            print(resolver.timing_report(), file=sys.stderr)
+        if args.profile:
+            report_profile(args, profiler)
+
+
+def report_profile(args, profiler: StageProfiler):
+    """Ispiši tabelu faza na stderr; JSON u fajl (--profile-json) ili na stderr."""
+    print(profiler.table(), file=sys.stderr)
+    data = json.dumps(profiler.to_dict(), ensure_ascii=False)
+    if args.profile_json:
+        Path(args.profile_json).write_text(data, encoding="utf-8")
+        print(f"[OK] Profil sačuvan: {args.profile_json}", file=sys.stderr)
+    else:
+        print(data, file=sys.stderr)
+    if args.profile_cprofile:
+        profiler.dump_cprofile(args.profile_cprofile)
+        print(f"[OK] cProfile (infer) sačuvan: {args.profile_cprofile}", file=sys.stderr)
+
+
+def run(args, resolver):
+    """Izvrši odabrani režim CLI-a nad već napravljenim resolverom."""
+    # 0) Strukturirani izlaz: samo klasteri, bez zamjene
+    if args.clusters_out:
+        texts = [Path(args.in_path).read_text(encoding="utf-8")] if args.in_path else get_examples()
+        n = write_clusters_jsonl(args.clusters_out,
+                                 ((i, t, c) for i, (t, c) in
+                                  enumerate(zip(texts, resolver.clusters_many(texts)))))
+        print(f"[OK] Sačuvano {n} zapisa klastera: {args.clusters_out}")
+        return
+
     # 1) Ako je --in proslijeđen -> standardni režim (jedan ulaz)
     if args.in_path:
         text = Path(args.in_path).read_text(encoding="utf-8")
-        resolved = (
-            resolve_text(text)
-            if len(text) <= args.max_chars
-            else chunk_and_resolve(text, max_chars=args.max_chars, overlap_sents=args.overlap_sents)
-        )
+        resolved = resolver.resolve(text)
         if args.out_path:
             Path(args.out_path).write_text(resolved, encoding="utf-8")
             print(f"[OK] Sačuvano: {args.out_path}")
@@ -168,7 +531,7 @@ def main():
 
     # 2) Bez --in -> pokreni 10 ugrađenih primjera i ispiši lijepo
     examples = get_examples()
-    print_examples_pretty(examples)
+    print_examples_pretty(examples, resolver=resolver)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,205 @@
+"""
+Zajednički pozivi Cohere chat API-ja za metode.
+
+chat() vraća cijeli odgovor (co.chat). chat_stream() koristi co.chat_stream,
+sklapa linije kako tokeni stižu i poziva abort_on(linija) za svaku završenu
+liniju; čim vrati True, stream se zatvara (prekida se generisanje, pa se ne
+plaćaju ni ostali output tokeni) i vraća se tekst do te linije uključno.
+
+TieredLLM bira model po nivou poziva ("base" za 1. prolaz, "context" za
+prolaze sa kontekstom/rewrite, opcionalno "escalate"): ako izlaz ima
+nevalidne linije (ili, kad se traži, zamjenice u S/O), isti prompt se ponovi
+na "escalate" modelu. Ako je data funkcija `repair`, pokvarene linije se prvo
+jeftino popravljaju, a eskalira se tek kad poslije popravke nema nijedne
+validne linije. Kad pozivalac javi da zamjenicu u S/O ionako rješava sljedeći
+prolaz (pronoun_fallback), takav izlaz se vraća odmah, bez popravke i
+eskalacije. Broji pozive i latenciju po nivou.
+
+Hedger (opcionalno) skraćuje "rep" latencije: ako (ne-stream) poziv nije
+vratio odgovor nakon zadatog percentila nedavnih latencija tog modela, šalje
+se duplikat i koristi se odgovor koji stigne prvi. Udio hedge poziva je
+ograničen (max_rate), pa ukupan broj poziva raste najviše za toliko.
+"""
+
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+
+from triplet_parser import Triplet, parse_response, has_pronoun_in_SO
+
+
+def chat(co, model: str, prompt: str) -> str:
+    resp = co.chat(
+        model=model,
+        messages=[{'role': 'user', 'content': prompt}]
+    )
+    out = ""
+    for item in resp.message.content:
+        if item.type == 'text':
+            out += item.text
+    return out.strip()
+
+
+def chat_stream(co, model: str, prompt: str,
+                abort_on: Optional[Callable[[str], bool]] = None) -> str:
+    stream = co.chat_stream(
+        model=model,
+        messages=[{'role': 'user', 'content': prompt}]
+    )
+    lines, buf = [], ""
+    try:
+        for event in stream:
+            if getattr(event, "type", None) != "content-delta":
+                continue
+            buf += event.delta.message.content.text or ""
+            while "\n" in buf:
+                line, buf = buf.split("\n", 1)
+                lines.append(line)
+                if abort_on and line.strip() and abort_on(line):
+                    print(f"✂️ Stream aborted after {len(lines)} line(s).")
+                    return "\n".join(lines).strip()
+    finally:
+        close = getattr(stream, "close", None)
+        if close:
+            close()  # zatvara HTTP stream (i kad se prekida ranije)
+    lines.append(buf)
+    return "\n".join(lines).strip()
+
+
+class Hedger:
+    """Hedge za spore pozive: prag = percentil zadnjih `window` latencija po modelu."""
+
+    def __init__(self, percentile: float = 0.95, max_rate: float = 0.05,
+                 min_samples: int = 20, window: int = 200):
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self.window = window
+        self._latencies: Dict[str, deque] = {}
+        self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="llm-hedge")
+        self.calls = 0
+        self.sent = 0
+        self.won = 0
+
+    def threshold(self, model: str) -> Optional[float]:
+        lat = self._latencies.get(model)
+        if not lat or len(lat) < self.min_samples:
+            return None
+        ranked = sorted(lat)
+        return ranked[min(len(ranked) - 1, int(self.percentile * len(ranked)))]
+
+    def _record(self, model: str, seconds: float):
+        self._latencies.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def run(self, model: str, fn: Callable[[], str]) -> str:
+        """fn() je jedan (idempotentan) API poziv; vraća rezultat bržeg od primarnog i hedge poziva."""
+        self.calls += 1
+        t0 = time.perf_counter()
+        limit = self.threshold(model)
+        primary = self._pool.submit(fn)
+        done, _ = wait([primary], timeout=limit)
+        if done or self.sent + 1 > self.max_rate * self.calls:
+            result = primary.result()
+            self._record(model, time.perf_counter() - t0)
+            return result
+
+        self.sent += 1
+        hedge = self._pool.submit(fn)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is not None:
+                    error = fut.exception()
+                    continue
+                if fut is hedge:
+                    self.won += 1
+                # sporiji poziv se ne može prekinuti; njegov rezultat se ignoriše
+                self._record(model, time.perf_counter() - t0)
+                return fut.result()
+        raise error
+
+    def report(self):
+        if self.calls:
+            print(f"🪃 Hedging: {self.sent} hedge(s) sent for {self.calls} call(s) "
+                  f"({100.0 * self.sent / self.calls:.1f}%), {self.won} won")
+
+
+class TieredLLM:
+    """Model po nivou + statistika; `co` se prosljeđuje po pozivu (metode ga drže u CONFIG-u)."""
+
+    def __init__(self, tiers: Dict[str, Optional[str]], hedger: Optional[Hedger] = None,
+                 repair: Optional[Callable[[List[Triplet]], List[Triplet]]] = None):
+        self.tiers = tiers
+        self.hedger = hedger
+        self.repair = repair
+        self.stats = {tier: {"calls": 0, "seconds": 0.0} for tier in tiers}
+        self.escalations = 0
+
+    def _timed(self, co, tier: str, prompt: str, abort_on=None) -> str:
+        model = self.tiers[tier]
+        t0 = time.perf_counter()
+        if abort_on is not None:
+            out = chat_stream(co, model, prompt, abort_on)
+        elif self.hedger is not None:
+            out = self.hedger.run(model, lambda: chat(co, model, prompt))
+        else:
+            out = chat(co, model, prompt)
+        st = self.stats[tier]
+        st["calls"] += 1
+        st["seconds"] += time.perf_counter() - t0
+        return out
+
+    def _repaired(self, out: str):
+        """(tekst, parsirane linije) poslije popravke; bez repair-a samo parsiranje."""
+        parsed = [t for t in parse_response(out) if t.raw]
+        if self.repair is None:
+            return out, parsed
+        fixed = self.repair(parsed)
+        if any(a is not b for a, b in zip(parsed, fixed)):
+            out = "\n".join(t.raw for t in fixed)
+        return out, fixed
+
+    def call(self, co, prompt: str, tier: str = "base", abort_on=None,
+             check_pronouns: bool = False, escalate: bool = True,
+             pronoun_fallback: bool = False) -> str:
+        """
+        escalate=False za odgovore koji nisu tripleti (npr. rewrite teksta), za mjerenja
+        i za same fix-up pozive: tada nema ni popravke ni eskalacije.
+        check_pronouns: eskaliraj i kad izlaz još ima zamjenicu u S/O (prolazi sa kontekstom).
+        pronoun_fallback: izlaz sa zamjenicom u S/O pozivalac baca (slijedi prolaz sa
+        kontekstom/rewrite), pa se ne popravlja i ne eskalira.
+        """
+        out = self._timed(co, tier, prompt, abort_on)
+        if not escalate:
+            return out
+
+        parsed = [t for t in parse_response(out) if t.raw]
+        if pronoun_fallback and has_pronoun_in_SO(parsed):
+            return out  # slijedi prolaz sa kontekstom/rewrite, popravka/eskalacija nema smisla
+        out, parsed = self._repaired(out)
+
+        esc_model = self.tiers.get("escalate")
+        if not esc_model or tier == "escalate" or esc_model == self.tiers[tier]:
+            return out
+        if self.repair is not None:
+            broken = bool(parsed) and not any(t.valid for t in parsed)  # popravka nije spasila ništa
+        else:
+            broken = any(not t.valid for t in parsed)
+        if broken or (check_pronouns and has_pronoun_in_SO(parsed)):
+            self.escalations += 1
+            print(f"⏫ Escalating {tier} pass ({self.tiers[tier]}) to {esc_model} ...")
+            out, _ = self._repaired(self._timed(co, "escalate", prompt))
+        return out
+
+    def report(self):
+        for tier, st in self.stats.items():
+            if st["calls"]:
+                print(f"🤖 {tier:<8} {self.tiers[tier]:<24} {st['calls']:>6} call(s), "
+                      f"avg {st['seconds'] / st['calls']:.2f}s, total {st['seconds']:.1f}s")
+        if self.escalations:
+            print(f"⏫ {self.escalations} escalation(s)")
+        if self.hedger is not None:
+            self.hedger.report()
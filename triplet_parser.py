@@ -0,0 +1,100 @@
+"""
+Parser LLM odgovora u triplete — jedan prolaz po odgovoru.
+
+Svaka linija odgovora postaje Triplet sa već razdvojenim subject/relation/object,
+razlogom validnosti i zastavicama za zamjenice u S/O, pa validacija, provjera
+zamjenica i upis ne moraju ponovo normalizovati i splitati isti tekst.
+"""
+
+import re
+from typing import List, Optional
+
+# --- Skup zamjenica (lowercase) ---
+PRONOUNS = {
+    "i","me","myself","my","mine",
+    "he","him","himself","his",
+    "she","her","herself","hers",
+    "it","itself","its",
+    "they","them","themselves","themself","their","theirs",
+    "who","whom","whose"
+}
+
+WORD_RE = re.compile(r"\b[\w&'’-]+\b", flags=re.UNICODE)  # tokenizacija sa granicama riječi
+
+# razlozi (Triplet.reason)
+OK = "ok"
+BAD_PART_COUNT = "part_count"
+EMPTY_PART = "empty_part"
+NULL_PART = "null_part"
+
+
+def normalize_triplet_line(line: str) -> str:
+    # Ujednači razmake oko delimiter-a
+    return line.replace('" | "', '"|"').replace('" |"', '"|"').replace('"| "', '"|"')
+
+def split_triplet_line(line: str) -> List[str]:
+    return normalize_triplet_line(line).strip().strip('"').split('"|"')
+
+def invalid_reason(parts: List[str]) -> str:
+    if len(parts) != 3:
+        return BAD_PART_COUNT
+    for p in parts:
+        val = p.strip().lower()
+        if val == "":
+            return EMPTY_PART
+        if val == "null":
+            return NULL_PART
+    return OK
+
+def is_valid_triplet(parts: List[str]) -> bool:
+    return invalid_reason(parts) == OK
+
+def entity_contains_pronoun(entity_text: str) -> bool:
+    """Provjera da li subjekt ili objekt sadrži ijednu zamjenicu iz skupa, po riječima (sa granicom riječi)."""
+    tokens = [t.lower() for t in WORD_RE.findall(entity_text)]
+    return any(tok in PRONOUNS for tok in tokens)
+
+
+class Triplet:
+    """Jedna linija odgovora, parsirana jednom."""
+
+    __slots__ = ("raw", "subject", "relation", "object", "reason",
+                 "subject_pronoun", "object_pronoun")
+
+    def __init__(self, raw: str, parts: List[str]):
+        self.raw = raw
+        self.reason = invalid_reason(parts)
+        if len(parts) >= 3:
+            self.subject, self.relation, self.object = parts[0], parts[1], parts[2]
+            self.subject_pronoun = entity_contains_pronoun(self.subject)
+            self.object_pronoun = entity_contains_pronoun(self.object)
+        else:
+            self.subject = self.relation = self.object = None
+            self.subject_pronoun = self.object_pronoun = False
+
+    @property
+    def valid(self) -> bool:
+        return self.reason == OK
+
+    @property
+    def has_pronoun(self) -> bool:
+        return self.subject_pronoun or self.object_pronoun
+
+    def __repr__(self) -> str:
+        return f"Triplet({self.raw!r}, reason={self.reason!r})"
+
+
+def parse_triplet_line(line: str) -> Triplet:
+    return Triplet(line.strip(), split_triplet_line(line))
+
+def parse_response(text: Optional[str]) -> List[Triplet]:
+    """Svaka linija odgovora (i prazna) -> Triplet; redoslijed se čuva."""
+    return [parse_triplet_line(line) for line in (text or "").splitlines()]
+
+def line_has_pronoun_in_SO(line: str) -> bool:
+    """Isto kao has_pronoun_in_SO, ali za jednu (npr. upravo streamovanu) liniju."""
+    return parse_triplet_line(line).has_pronoun
+
+def has_pronoun_in_SO(triplets: List[Triplet]) -> bool:
+    """True ako ijedan triplet (sa >= 3 dijela) ima zamjenicu u subjektu ili objektu."""
+    return any(t.has_pronoun for t in triplets)
@@ -0,0 +1,93 @@
+"""
+Popravka pokvarenih triplet linija (umjesto gubitka cijelog chunka).
+
+Lokalno se provjeravaju pravila iz prompta: 3 dijela, subjekt i objekt 1–5
+riječi, relacija 1–4 riječi. Samo linije koje ih krše (i liče na triplet, tj.
+imaju "|") idu nazad modelu u kratkom, numerisanom fix-up promptu, bez teksta
+chunka i few-shot primjera. Popravljena linija zamjenjuje original na istom
+mjestu; "SKIP" ili nova greška ostavljaju original (loš ide u BAD_CSV, a
+strukturno validan ali predug ostaje kakav jeste). Najviše max_rounds poziva.
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+from triplet_parser import Triplet, parse_triplet_line
+
+MAX_ENTITY_WORDS = 5
+MAX_RELATION_WORDS = 4
+
+# razlozi povrh triplet_parser razloga
+SUBJECT_LEN = "subject_len"
+RELATION_LEN = "relation_len"
+OBJECT_LEN = "object_len"
+
+_NUMBERED_RE = re.compile(r"^\s*(\d+)[.)]\s*(.*)$")
+
+
+def rule_violation(t: Triplet) -> Optional[str]:
+    """Razlog zašto linija krši pravila prompta, ili None ako je u redu."""
+    if not t.valid:
+        return t.reason
+    if not 1 <= len(t.subject.split()) <= MAX_ENTITY_WORDS:
+        return SUBJECT_LEN
+    if not 1 <= len(t.relation.split()) <= MAX_RELATION_WORDS:
+        return RELATION_LEN
+    if not 1 <= len(t.object.split()) <= MAX_ENTITY_WORDS:
+        return OBJECT_LEN
+    return None
+
+
+def build_repair_prompt(lines: List[str]) -> str:
+    numbered = "\n".join(f"{i}. {line}" for i, line in enumerate(lines, 1))
+    return f"""Fix each numbered line into one triplet "Subject"|"Relation"|"Object".
+RULES: subject and object 1–5 words, relation 1–4 words, keep the original fact, no explanations.
+Answer with the same numbers, one line each. If a line cannot be fixed, answer SKIP for it.
+
+{numbered}
+"""
+
+
+def _parse_repairs(text: str) -> Tuple[Dict[int, Triplet], set]:
+    """(popravljene linije po broju, brojevi za koje je model odgovorio SKIP)."""
+    fixed, skipped = {}, set()
+    for line in (text or "").splitlines():
+        m = _NUMBERED_RE.match(line)
+        if not m:
+            continue
+        n = int(m.group(1))
+        if m.group(2).strip().strip('"').upper() == "SKIP":
+            skipped.add(n)
+            continue
+        t = parse_triplet_line(m.group(2))
+        if rule_violation(t) is None:
+            fixed[n] = t
+    return fixed, skipped
+
+
+def repair_triplets(parsed: List[Triplet], call_llm, max_rounds: int = 2,
+                    max_lines: int = 20) -> Tuple[List[Triplet], Dict[str, int]]:
+    """
+    call_llm(prompt) -> str. Vraća (nova lista istim redoslijedom, statistika
+    {"offending", "repaired", "calls"}).
+    """
+    out = list(parsed)
+    offending = [i for i, t in enumerate(out) if "|" in t.raw and rule_violation(t) is not None]
+    stats = {"offending": len(offending), "repaired": 0, "calls": 0}
+
+    todo = offending[:max_lines]
+    for _ in range(max_rounds):
+        if not todo:
+            break
+        response = call_llm(build_repair_prompt([out[i].raw for i in todo]))
+        stats["calls"] += 1
+        fixed, skipped = _parse_repairs(response)
+        still = []
+        for n, i in enumerate(todo, 1):
+            if n in fixed:
+                out[i] = fixed[n]
+                stats["repaired"] += 1
+            elif n not in skipped:  # SKIP se ne ponavlja
+                still.append(i)
+        todo = still
+    return out, stats
@@ -0,0 +1,406 @@
+"""
+Izlazni "sinkovi" za triplete.
+
+- CsvTripletSink: postojeći pipe-delimited CSV format (chunk_ID|question_ID|triplet).
+- ParquetTripletSink: kolonarni izlaz (opcionalno, treba pyarrow). Redovi se
+  baferuju i pišu kao kompresovani Parquet fajlovi u dva dataseta:
+      <dir>/good/part-*.parquet  chunk_ID, question_ID, subject, relation, object, method
+      <dir>/bad/part-*.parquet   chunk_ID, question_ID, bad_triplet, reason, method
+  Čitanje: pyarrow.dataset.dataset("<dir>/good") ili pd.read_parquet("<dir>/good").
+  Baferovani redovi se pišu i u <dir>/_wal.jsonl; sync() fsync-uje samo WAL,
+  a part fajl (~batch_rows redova) nastaje tek kad se bafer napuni.
+
+truncate_file() vraća CSV na veličinu zapisanu u journalu pri zadnjem commitu,
+a truncate_parquet_outputs() izbacuje redove chunkova koji nisu u journalu
+(resume nakon pada, vidi triplet_writer).
+
+open_sinks() bira sink(ove) prema OUTPUT_FORMAT ("csv" | "parquet" | "both"),
+opcionalno iza DedupSink-a koji ne propušta isti triplet dva puta za isti question_ID.
+"""
+
+import csv
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # opcionalno; potrebno samo za parquet izlaz
+    pa = pq = None
+
+OUTPUT_FORMATS = ("csv", "parquet", "both")
+
+
+class CsvTripletSink:
+    """Dobri i loši tripleti u dva pipe-delimited CSV fajla (append, zaglavlje samo za nove fajlove)."""
+
+    def __init__(self, good_path: str, bad_path: str):
+        # prazan fajl (npr. odsječen na 0 pri oporavku) dobija zaglavlje kao nov
+        good_exists = os.path.isfile(good_path) and os.path.getsize(good_path) > 0
+        bad_exists = os.path.isfile(bad_path) and os.path.getsize(bad_path) > 0
+        self.good_f = open(good_path, "a", encoding="utf-8", newline="")
+        self.bad_f = open(bad_path, "a", encoding="utf-8", newline="")
+        self.good_w = csv.writer(self.good_f, delimiter='|', quoting=csv.QUOTE_MINIMAL)
+        self.bad_w = csv.writer(self.bad_f, delimiter='|', quoting=csv.QUOTE_MINIMAL)
+        if not good_exists:
+            self.good_w.writerow(["chunk_ID", "question_ID", "triplet"])
+        if not bad_exists:
+            self.bad_w.writerow(["chunk_ID", "question_ID", "bad_triplet"])
+
+    def add_good(self, chunk_id, question_id, triplet):
+        self.good_w.writerow([chunk_id, question_id, triplet.raw])
+
+    def add_bad(self, chunk_id, question_id, raw: str, reason: str = None):
+        self.bad_w.writerow([chunk_id, question_id, raw])
+
+    def flush(self):
+        self.good_f.flush()
+        self.bad_f.flush()
+
+    def sync(self):
+        """flush + fsync: redovi su na disku i nakon pada procesa/mašine."""
+        self.flush()
+        os.fsync(self.good_f.fileno())
+        os.fsync(self.bad_f.fileno())
+
+    def sizes(self) -> dict:
+        """Veličine fajlova u bajtovima (poslije flush-a/sync-a); journal ih pamti pri commitu."""
+        return {"good": os.fstat(self.good_f.fileno()).st_size,
+                "bad": os.fstat(self.bad_f.fileno()).st_size}
+
+    def close(self):
+        self.good_f.close()
+        self.bad_f.close()
+
+
+WAL_NAME = "_wal.jsonl"
+
+
+class ParquetTripletSink:
+    """
+    Baferuje redove po kolonama i piše ih kao Parquet part fajlove (batch_rows po fajlu).
+    Trajnost do sljedećeg part fajla daje WAL: jedan JSON red po tripletu, fsync na sync().
+    """
+
+    def __init__(self, out_dir: str, method: str, batch_rows: int = 50_000,
+                 compression: str = "zstd"):
+        if pa is None:
+            raise ImportError("Parquet izlaz traži pyarrow: pip install pyarrow")
+        self.good_dir = os.path.join(out_dir, "good")
+        self.bad_dir = os.path.join(out_dir, "bad")
+        os.makedirs(self.good_dir, exist_ok=True)
+        os.makedirs(self.bad_dir, exist_ok=True)
+        self.method = method
+        self.batch_rows = batch_rows
+        self.compression = compression
+        self.good_schema = pa.schema([
+            ("chunk_ID", pa.int64()), ("question_ID", pa.string()),
+            ("subject", pa.string()), ("relation", pa.string()), ("object", pa.string()),
+            ("method", pa.string()),
+        ])
+        self.bad_schema = pa.schema([
+            ("chunk_ID", pa.int64()), ("question_ID", pa.string()),
+            ("bad_triplet", pa.string()), ("reason", pa.string()),
+            ("method", pa.string()),
+        ])
+        self._good = {name: [] for name in self.good_schema.names}
+        self._bad = {name: [] for name in self.bad_schema.names}
+
+        # redovi iz WAL-a prethodnog (prekinutog) pokretanja se vraćaju u bafer
+        self.wal_path = os.path.join(out_dir, WAL_NAME)
+        if os.path.isfile(self.wal_path):
+            for kind, row in _read_wal(self.wal_path):
+                self._buffer(kind, row)
+        self._wal = open(self.wal_path, "a", encoding="utf-8")
+
+    @staticmethod
+    def _qid(question_id):
+        return None if question_id is None else str(question_id)
+
+    def _buffer(self, kind: str, row: dict):
+        cols = self._good if kind == "good" else self._bad
+        for name, v in cols.items():
+            v.append(row[name])
+
+    def _add(self, kind: str, row: dict):
+        self._buffer(kind, row)
+        self._wal.write(json.dumps([kind, row], ensure_ascii=False) + "\n")
+
+    def add_good(self, chunk_id, question_id, triplet):
+        self._add("good", {
+            "chunk_ID": int(chunk_id), "question_ID": self._qid(question_id),
+            "subject": triplet.subject.strip(), "relation": triplet.relation.strip(),
+            "object": triplet.object.strip(), "method": self.method,
+        })
+
+    def add_bad(self, chunk_id, question_id, raw: str, reason: str = None):
+        self._add("bad", {
+            "chunk_ID": int(chunk_id), "question_ID": self._qid(question_id),
+            "bad_triplet": raw, "reason": reason, "method": self.method,
+        })
+
+    def _write(self, cols: dict, schema, out_dir: str):
+        if not cols["chunk_ID"]:
+            return
+        table = pa.Table.from_pydict(cols, schema=schema)
+        name = f"part-{time.time_ns()}-{os.getpid()}.parquet"
+        tmp = os.path.join(out_dir, "." + name + ".tmp")
+        pq.write_table(table, tmp, compression=self.compression)
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(out_dir, name))  # reader nikad ne vidi pola fajla
+        for v in cols.values():
+            v.clear()
+
+    def flush(self):
+        """Sve baferovano u part fajlove, pa prazan WAL (redovi su sad u partovima)."""
+        self._write(self._good, self.good_schema, self.good_dir)
+        self._write(self._bad, self.bad_schema, self.bad_dir)
+        self._wal.seek(0)
+        self._wal.truncate()
+        self._wal.flush()
+        os.fsync(self._wal.fileno())
+
+    def sync(self):
+        # part fajl tek kad se skupi batch_rows; do tada trajnost daje WAL
+        if max(len(self._good["chunk_ID"]), len(self._bad["chunk_ID"])) >= self.batch_rows:
+            self.flush()
+        else:
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+
+    def sizes(self) -> dict:
+        return {}  # oporavak Parqueta ide po chunk_ID-jevima (truncate_parquet_outputs)
+
+    def close(self):
+        self.flush()
+        self._wal.close()
+
+
+class MultiSink:
+    """Isti redovi u više sinkova (npr. CSV + Parquet)."""
+
+    def __init__(self, sinks: list):
+        self.sinks = sinks
+
+    def add_good(self, chunk_id, question_id, triplet):
+        for s in self.sinks:
+            s.add_good(chunk_id, question_id, triplet)
+
+    def add_bad(self, chunk_id, question_id, raw: str, reason: str = None):
+        for s in self.sinks:
+            s.add_bad(chunk_id, question_id, raw, reason)
+
+    def flush(self):
+        for s in self.sinks:
+            s.flush()
+
+    def sync(self):
+        for s in self.sinks:
+            s.sync()
+
+    def sizes(self) -> dict:
+        out = {}
+        for s in self.sinks:
+            out.update(s.sizes())
+        return out
+
+    def close(self):
+        for s in self.sinks:
+            s.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_WS_RE = re.compile(r"\s+")
+
+
+def triplet_key(triplet) -> tuple:
+    """Normalizovan (subject, relation, object): bez navodnika, višak razmaka i velikih slova."""
+    return tuple(_WS_RE.sub(" ", part).strip().strip('"').strip().casefold()
+                 for part in (triplet.subject, triplet.relation, triplet.object))
+
+
+class DedupSink:
+    """
+    Ispred drugog sinka: dobar triplet se propušta samo ako njegov ključ još nije
+    viđen za isti question_ID. Memorija je ograničena: najviše max_questions
+    aktivnih pitanja (LRU) i max_keys ključeva po pitanju (najstariji ispadaju).
+    Loši tripleti idu dalje bez filtriranja.
+    """
+
+    def __init__(self, sink, max_questions: int = 256, max_keys: int = 10_000):
+        self.sink = sink
+        self.max_questions = max_questions
+        self.max_keys = max_keys
+        self._seen: "OrderedDict[object, dict]" = OrderedDict()
+        self.written = 0
+        self.duplicates = 0
+
+    def _keys_for(self, question_id) -> dict:
+        keys = self._seen.get(question_id)
+        if keys is None:
+            keys = self._seen[question_id] = {}
+            if len(self._seen) > self.max_questions:
+                self._seen.popitem(last=False)
+        else:
+            self._seen.move_to_end(question_id)
+        return keys
+
+    def add_good(self, chunk_id, question_id, triplet) -> bool:
+        keys = self._keys_for(question_id)
+        key = hash(triplet_key(triplet))
+        if key in keys:
+            self.duplicates += 1
+            return False
+        keys[key] = None  # dict čuva redoslijed umetanja -> FIFO izbacivanje
+        if len(keys) > self.max_keys:
+            del keys[next(iter(keys))]
+        self.sink.add_good(chunk_id, question_id, triplet)
+        self.written += 1
+        return True
+
+    def add_bad(self, chunk_id, question_id, raw: str, reason: str = None):
+        self.sink.add_bad(chunk_id, question_id, raw, reason)
+
+    def flush(self):
+        self.sink.flush()
+
+    def sync(self):
+        self.sink.sync()
+
+    def sizes(self) -> dict:
+        return self.sink.sizes()
+
+    def close(self):
+        self.sink.close()
+        total = self.written + self.duplicates
+        if total:
+            print(f"🧹 Dedup: {self.duplicates} duplicate triplet(s) dropped, {self.written} written "
+                  f"({100.0 * self.duplicates / total:.1f}% of valid lines).")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_sinks(output_format: str, output_csv: str, bad_csv: str,
+               parquet_dir: str, method: str, dedup: bool = False,
+               dedup_max_questions: int = 256, dedup_max_keys: int = 10_000):
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"OUTPUT_FORMAT mora biti jedan od {OUTPUT_FORMATS}, dobijeno: {output_format}")
+    sinks = []
+    if output_format in ("csv", "both"):
+        sinks.append(CsvTripletSink(output_csv, bad_csv))
+    if output_format in ("parquet", "both"):
+        sinks.append(ParquetTripletSink(parquet_dir, method))
+    if dedup:
+        return DedupSink(MultiSink(sinks), dedup_max_questions, dedup_max_keys)
+    return MultiSink(sinks)
+
+
+def _read_wal(path: str):
+    """(kind, row) iz WAL-a; nedovršena zadnja linija (pad usred upisa) se ignoriše."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.endswith("\n") and line.strip():
+                kind, row = json.loads(line)
+                yield kind, row
+
+
+def truncate_file(path: str, size: int) -> int:
+    """
+    Vraća fajl na `size` bajtova (stanje zadnjeg commita). Sve iza toga su redovi
+    chunkova koji nisu commitovani ili prekinut upis; reže se po bajtovima, pa
+    višelinijska polja (npr. cijeli odgovor u "no_valid" redu) ne smetaju.
+    Vraća broj odsječenih bajtova.
+    """
+    if not os.path.isfile(path):
+        return 0
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        if end <= size:
+            return 0
+        f.truncate(size)
+        f.flush()
+        os.fsync(f.fileno())
+    return end - size
+
+
+def truncate_parquet_outputs(parquet_dir: str, done: set) -> int:
+    """
+    Isto za Parquet: iz najnovijih part fajlova (i WAL-a) izbacuje redove chunkova
+    koji nisu u journalu. WAL redovi chunkova koji su već u najnovijem partu se
+    takođe izbacuju (pad između upisa parta i pražnjenja WAL-a).
+    """
+    if pa is None or not os.path.isdir(parquet_dir):
+        return 0
+    dropped, newest_ids = 0, set()
+    for sub in ("good", "bad"):
+        d = os.path.join(parquet_dir, sub)
+        if not os.path.isdir(d):
+            continue
+        parts = sorted((f for f in os.listdir(d) if f.endswith(".parquet")), reverse=True)
+        for i, name in enumerate(parts):
+            path = os.path.join(d, name)
+            ids = pq.read_table(path, columns=["chunk_ID"]).column("chunk_ID").to_pylist()
+            if i == 0:
+                newest_ids.update(ids)
+            stray = [c for c in ids if c not in done]
+            if not stray:
+                break  # stariji partovi su commitovani prije ovog
+            dropped += len(stray)
+            table = pq.read_table(path)
+            keep = pa.array([c in done for c in ids])
+            if len(stray) == len(ids):
+                os.remove(path)
+            else:
+                tmp = os.path.join(d, "." + name + ".tmp")
+                pq.write_table(table.filter(keep), tmp, compression="zstd")
+                os.replace(tmp, path)
+
+    wal = os.path.join(parquet_dir, WAL_NAME)
+    if os.path.isfile(wal):
+        rows = list(_read_wal(wal))
+        kept = [r for r in rows if r[1]["chunk_ID"] in done and r[1]["chunk_ID"] not in newest_ids]
+        if len(kept) != len(rows):
+            dropped += len(rows) - len(kept)
+            tmp = wal + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in kept)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, wal)
+    return dropped
+
+
+def load_processed_chunk_ids(output_format: str, output_csv: str, parquet_dir: str) -> set:
+    """
+    chunk_ID-jevi koji već imaju dobre triplete (resume). Iz Parqueta se čita
+    samo kolona chunk_ID, a iz CSV-a također samo chunk_ID (usecols).
+    """
+    processed = set()
+    if output_format in ("parquet", "both") and pa is not None:
+        good_dir = os.path.join(parquet_dir, "good")
+        if os.path.isdir(good_dir) and any(f.endswith(".parquet") for f in os.listdir(good_dir)):
+            import pyarrow.dataset as ds
+            col = ds.dataset(good_dir, format="parquet").to_table(columns=["chunk_ID"]).column("chunk_ID")
+            processed.update(col.unique().to_pylist())
+    if output_format in ("csv", "both") and os.path.isfile(output_csv):
+        try:
+            existing = pd.read_csv(output_csv, delimiter='|', quotechar='"', usecols=["chunk_ID"])
+            processed.update(existing['chunk_ID'].astype(int).tolist())
+        except Exception as e:
+            print(f"⚠️ Greška pri čitanju postojećih tripleta: {e}")
+    return processed
@@ -0,0 +1,212 @@
+"""
+Asinhroni "group commit" pisač za triplete.
+
+Glavna petlja (LLM pozivi) samo stavlja redove u ograničen red (queue);
+posebna nit ih prosljeđuje sinku (CSV/Parquet, eventualno iza DedupSink-a)
+i periodično radi commit: flush + fsync izlaza, pa tek onda upis završenih
+chunk_ID-jeva u journal (<output_csv>.done, isto fsync). Jedan commit u
+journalu su ID-jevi (jedan po liniji; "<ID> no_valid" za chunk bez ijednog
+dobrog tripleta) i na kraju linija "@ good=<bajtova> bad=<bajtova>" sa
+veličinama CSV izlaza; commit bez te završne linije (prekinut upis journala)
+se ne računa. Commit se radi samo na granici chunka
+(poslije chunk_done), kad se skupi flush_rows redova ili prođe flush_seconds,
+pa redovi chunka i njegov unos u journalu postaju trajni zajedno.
+
+recover_outputs() na startu: journal je jedini autoritet za preskakanje
+chunkova (osim "no_valid" chunkova, koji se ponovo obrađuju kao i ranije, kad
+se resume čitao iz dobrog CSV-a); CSV izlazi se vraćaju na veličine iz zadnjeg commita (sve iza su
+redovi nedovršenih chunkova), a iz Parqueta se izbacuju redovi chunkova koji
+nisu u journalu. Stari izlazi bez journala se čitaju kao ranije (chunk_ID-jevi
+iz izlaza) i ti ID-jevi, sa trenutnim veličinama fajlova, čine prvi commit.
+"""
+
+import os
+import queue
+import threading
+import time
+
+from triplet_sink import load_processed_chunk_ids, truncate_file, truncate_parquet_outputs
+
+_GOOD, _BAD, _DONE, _STOP = range(4)
+
+
+def journal_path(output_csv: str) -> str:
+    return output_csv + ".done"
+
+
+def load_journal(path: str):
+    """
+    (chunk_ID-jevi sa dobrim tripletima, svi commitovani chunk_ID-jevi,
+    veličine izlaza iz zadnjeg potpunog commita).
+    """
+    done, committed, sizes, pending = set(), set(), {}, []
+    if not os.path.isfile(path):
+        return done, committed, sizes
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n") or not line.strip():
+                continue  # nedovršena zadnja linija se ignoriše
+            if line.startswith("@"):
+                for chunk_id, ok in pending:
+                    committed.add(chunk_id)
+                    if ok:
+                        done.add(chunk_id)
+                    else:
+                        done.discard(chunk_id)  # ponovljen pa opet bez dobrih tripleta
+                pending = []
+                sizes = {k: int(v) for k, v in (kv.split("=", 1) for kv in line[1:].split())}
+                continue
+            parts = line.split()
+            try:
+                pending.append((int(parts[0]), len(parts) == 1))
+            except ValueError:
+                pass
+    return done, committed, sizes
+
+
+def _append_commit(f, chunks, sizes: dict):
+    """chunks: (chunk_ID, ima dobrih tripleta) parovi."""
+    record = "".join(f"{int(c)}\n" if ok else f"{int(c)} no_valid\n" for c, ok in chunks)
+    record += "@" + "".join(f" {k}={v}" for k, v in sorted(sizes.items())) + "\n"
+    f.write(record)
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _file_size(path: str) -> int:
+    return os.path.getsize(path) if os.path.isfile(path) else 0
+
+
+def recover_outputs(output_format: str, output_csv: str, bad_csv: str, parquet_dir: str) -> set:
+    """chunk_ID-jevi za preskakanje; izlazi se prije toga vrate na stanje zadnjeg commita."""
+    journal = journal_path(output_csv)
+    if not os.path.isfile(journal):
+        legacy = load_processed_chunk_ids(output_format, output_csv, parquet_dir)
+        with open(journal, "a", encoding="utf-8") as f:
+            _append_commit(f, [(c, True) for c in sorted(legacy)], {"good": _file_size(output_csv), "bad": _file_size(bad_csv)})
+        if legacy:
+            print(f"📒 No journal yet: seeded {journal} with {len(legacy)} chunk(s) from existing output.")
+        return legacy
+
+    done, committed, sizes = load_journal(journal)
+    if done:
+        print(f"📒 {len(done)} chunk(s) already committed in {journal} will be skipped "
+              f"(delete it together with the outputs to start over).")
+    if output_format in ("csv", "both") and _file_size(output_csv) < sizes.get("good", 0):
+        print(f"⚠️ {output_csv} is smaller than at the last commit in {journal} (deleted or replaced?); "
+              f"its chunks are still skipped. Delete {journal} too to re-run them.")
+    if output_format in ("csv", "both"):
+        cut = sum(truncate_file(path, sizes[role])
+                  for role, path in (("good", output_csv), ("bad", bad_csv)) if role in sizes)
+        if cut:
+            print(f"📒 Recovery: cut {cut} uncommitted byte(s) from the CSV output(s) (see {journal}).")
+    if output_format in ("parquet", "both"):
+        dropped = truncate_parquet_outputs(parquet_dir, committed)
+        if dropped:
+            print(f"📒 Recovery: dropped {dropped} uncommitted Parquet row(s) (see {journal}).")
+    return done
+
+
+class GroupCommitWriter:
+    """Sink sa istim add_good/add_bad interfejsom, plus chunk_done(); pisanje ide u pozadinskoj niti."""
+
+    def __init__(self, sink, journal: str, flush_rows: int = 500,
+                 flush_seconds: float = 2.0, max_queue: int = 10_000):
+        self.sink = sink
+        self.journal = journal
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self._q: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._error = None
+        self.commits = 0
+        self.rows = 0
+        self._journal_f = open(journal, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._loop, name="triplet-writer", daemon=True)
+        self._thread.start()
+
+    # --- strana glavne petlje ---
+
+    def _put(self, item):
+        while True:
+            if self._error is not None:
+                raise RuntimeError("Triplet writer thread failed") from self._error
+            try:
+                self._q.put(item, timeout=1.0)  # blokira samo ako je red pun (pisač kasni)
+                return
+            except queue.Full:
+                continue
+
+    def add_good(self, chunk_id, question_id, triplet):
+        self._put((_GOOD, chunk_id, question_id, triplet, None))
+
+    def add_bad(self, chunk_id, question_id, raw: str, reason: str = None):
+        self._put((_BAD, chunk_id, question_id, raw, reason))
+
+    def chunk_done(self, chunk_id):
+        """Svi redovi chunka su predati; ID ide u journal sa sljedećim commitom."""
+        self._put((_DONE, chunk_id, None, None, None))
+
+    def close(self):
+        if self._thread.is_alive():
+            self._q.put((_STOP, None, None, None, None))
+            self._thread.join()
+        self._journal_f.close()
+        self.sink.close()
+        print(f"💾 Writer: {self.rows} row(s) in {self.commits} commit(s).")
+        if self._error is not None:
+            raise RuntimeError("Triplet writer thread failed") from self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- pozadinska nit ---
+
+    def _commit(self, done: list):
+        self.sink.sync()
+        if done:
+            _append_commit(self._journal_f, done, self.sink.sizes())
+        self.commits += 1
+
+    def _loop(self):
+        # pending_rows: redovi od zadnjeg commita; open_rows: redovi chunka koji još nije završen;
+        # open_good: da li je taj chunk dao ijedan dobar triplet (inače se journaluje kao no_valid)
+        pending_rows, open_rows, open_good, done = 0, 0, False, []
+        deadline = time.monotonic() + self.flush_seconds
+        try:
+            while True:
+                try:
+                    kind, chunk_id, qid, payload, reason = self._q.get(
+                        timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    kind = None
+
+                if kind == _GOOD:
+                    self.sink.add_good(chunk_id, qid, payload)
+                    pending_rows += 1
+                    open_rows += 1
+                    open_good = True
+                elif kind == _BAD:
+                    self.sink.add_bad(chunk_id, qid, payload, reason)
+                    pending_rows += 1
+                    open_rows += 1
+                elif kind == _DONE:
+                    done.append((chunk_id, open_good))
+                    open_rows, open_good = 0, False
+
+                due = pending_rows >= self.flush_rows or time.monotonic() >= deadline
+                # commit samo na granici chunka; redovi nezavršenog chunka čekaju njegov chunk_done.
+                # Na _STOP (npr. izuzetak usred chunka) završeni chunkovi se ipak commituju, a
+                # redove prekinutog chunka (nije u journalu) odsiječe recover_outputs.
+                if done and (kind == _STOP or (open_rows == 0 and due)):
+                    self._commit(done)
+                    self.rows += pending_rows
+                    pending_rows, done = 0, []
+                if due or kind == _STOP:
+                    deadline = time.monotonic() + self.flush_seconds
+                if kind == _STOP:
+                    return
+        except BaseException as e:  # greška se prijavljuje glavnoj niti na sljedećem _put/close
+            self._error = e
@@ -0,0 +1,413 @@
+"""
+Shard mod: više worker procesa (ili mašina sa zajedničkim diskom) nad istim
+paragraph_chunks2.csv, bez ručnog mijenjanja START_CHUNK_ID (u shard modu se
+START_CHUNK_ID ne primjenjuje: opseg rada je shard, pa se obrade svi njegovi chunkovi).
+
+- init:   podijeli chunkove po question_ID u N shardova (kontekst "prethodnih
+          chunkova" uvijek ostaje unutar jednog sharda) i upiši ih u SQLite red.
+- work:   worker uzima shard sa lease-om (ističe nakon --lease sekundi ako
+          worker umre), obnavlja ga dok radi i označi shard kao done.
+          Svaki shard piše u svoje fajlove: <shard_dir>/shard_0007/...
+- merge:  spoji izlaze svih shardova u OUTPUT_CSV / BAD_CSV metode, po chunk_ID
+          (k-way merge već poredanih shardova, bez učitavanja svih redova).
+- status: pregled reda.
+
+Pokretanje:
+    python work_queue.py init   --method SecondMethod --shards 16
+    python work_queue.py work   --method SecondMethod          # na svakom workeru
+    python work_queue.py status --method SecondMethod
+    python work_queue.py merge  --method SecondMethod
+"""
+
+import argparse
+import csv
+import heapq
+import importlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import ExitStack
+
+DEFAULT_LEASE_S = 900
+
+# ======= Red (SQLite) =======
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    shard_id      INTEGER PRIMARY KEY,
+    question_ids  TEXT    NOT NULL,   -- JSON lista
+    n_chunks      INTEGER NOT NULL,
+    status        TEXT    NOT NULL DEFAULT 'pending',  -- pending | leased | done
+    owner         TEXT,
+    lease_expires REAL,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    updated       REAL
+)
+"""
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(SCHEMA)
+    return conn
+
+
+def partition_questions(df, n_shards: int) -> list:
+    """
+    Grupe po question_ID raspoređene u n_shards (najveća grupa ide u trenutno
+    najlakši shard). Vraća [(question_ids, n_chunks), ...] bez praznih shardova.
+    """
+    sizes = df.groupby('question_ID', dropna=False, sort=False).size()
+    groups = sorted(((int(n), q.item() if hasattr(q, "item") else q) for q, n in sizes.items()),
+                    key=lambda g: -g[0])
+    heap = [(0, i) for i in range(n_shards)]
+    shards = [[] for _ in range(n_shards)]
+    loads = [0] * n_shards
+    for n, qid in groups:
+        load, i = heapq.heappop(heap)
+        shards[i].append(qid)
+        loads[i] = load + n
+        heapq.heappush(heap, (loads[i], i))
+    return [(qids, loads[i]) for i, qids in enumerate(shards) if qids]
+
+
+def init_queue(conn: sqlite3.Connection, df, n_shards: int):
+    if conn.execute("SELECT COUNT(*) FROM shards").fetchone()[0]:
+        raise SystemExit("⚠️ Red već postoji (obriši .sqlite fajl za novu podjelu).")
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    for shard_id, (qids, n) in enumerate(partition_questions(df, n_shards)):
+        conn.execute("INSERT INTO shards (shard_id, question_ids, n_chunks, updated) VALUES (?, ?, ?, ?)",
+                     (shard_id, json.dumps(qids), n, now))
+    conn.execute("COMMIT")
+
+
+def claim_shard(conn: sqlite3.Connection, owner: str, lease_s: float):
+    """Atomarno uzmi pending shard ili shard čiji je lease istekao. None ako nema posla."""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    row = conn.execute(
+        "SELECT shard_id, question_ids FROM shards "
+        "WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) "
+        "ORDER BY shard_id LIMIT 1", (now,)).fetchone()
+    if row is None:
+        conn.execute("COMMIT")
+        return None
+    conn.execute("UPDATE shards SET status = 'leased', owner = ?, lease_expires = ?, "
+                 "attempts = attempts + 1, updated = ? WHERE shard_id = ?",
+                 (owner, now + lease_s, now, row[0]))
+    conn.execute("COMMIT")
+    return row[0], json.loads(row[1])
+
+
+def renew_lease(conn: sqlite3.Connection, shard_id: int, owner: str, lease_s: float) -> bool:
+    now = time.time()
+    cur = conn.execute("UPDATE shards SET lease_expires = ?, updated = ? "
+                       "WHERE shard_id = ? AND owner = ? AND status = 'leased'",
+                       (now + lease_s, now, shard_id, owner))
+    return cur.rowcount == 1
+
+
+def complete_shard(conn: sqlite3.Connection, shard_id: int, owner: str) -> bool:
+    cur = conn.execute("UPDATE shards SET status = 'done', lease_expires = NULL, updated = ? "
+                       "WHERE shard_id = ? AND owner = ? AND status = 'leased'",
+                       (time.time(), shard_id, owner))
+    return cur.rowcount == 1
+
+
+class LeaseKeeper(threading.Thread):
+    """
+    Obnavlja lease svakih lease_s/3 sekundi; lost postaje True ako lease preuzme
+    neko drugi ili obnova (npr. "database is locked") ne uspije ni uz ponavljanje
+    prije nego što lease istekne (uz rezervu), jer ga tada drugi worker može uzeti.
+    """
+
+    def __init__(self, db_path: str, shard_id: int, owner: str, lease_s: float):
+        super().__init__(daemon=True)
+        self.db_path, self.shard_id, self.owner, self.lease_s = db_path, shard_id, owner, lease_s
+        self.lost = False
+        self._stop_event = threading.Event()
+        self._expires = time.time() + lease_s  # lease je upravo uzet
+        self._margin = min(60.0, lease_s / 6)
+
+    def _renew(self, conn) -> bool:
+        """Jedna obnova sa ponavljanjem; False ako lease nije naš ili vrijeme ističe."""
+        backoff = 0.5
+        while True:
+            try:
+                if conn[0] is None:
+                    conn[0] = connect(self.db_path)
+                ok = renew_lease(conn[0], self.shard_id, self.owner, self.lease_s)
+            except sqlite3.Error as e:
+                print(f"⚠️ Lease renew for shard {self.shard_id} failed ({e}); retrying in {backoff:.1f}s")
+                if conn[0] is not None:
+                    conn[0].close()
+                    conn[0] = None
+                if time.time() + backoff >= self._expires - self._margin:
+                    return False
+                if self._stop_event.wait(backoff):
+                    return True  # zaustavljen; lease se ionako pušta
+                backoff = min(backoff * 2, 10.0)
+                continue
+            if ok:
+                self._expires = time.time() + self.lease_s
+            return ok
+
+    def run(self):
+        conn = [None]
+        try:
+            while not self._stop_event.wait(self.lease_s / 3):
+                if not self._renew(conn):
+                    self.lost = True
+                    return
+        except BaseException:
+            self.lost = True  # nit umire -> worker mora stati
+            raise
+        finally:
+            if conn[0] is not None:
+                conn[0].close()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+# ======= Metode i putanje =======
+
+def load_method(name: str):
+    mod = importlib.import_module(name)
+    for attr in ("load_chunks", "run", "OUTPUT_CSV", "BAD_CSV", "PARQUET_DIR", "OUTPUT_FORMAT"):
+        if not hasattr(mod, attr):
+            raise SystemExit(f"⚠️ {name} nema '{attr}' (nije podržan u shard modu).")
+    return mod
+
+
+def shard_paths(shard_dir: str, shard_id: int) -> dict:
+    base = os.path.join(shard_dir, f"shard_{shard_id:04d}")
+    return {
+        "dir": base,
+        "output_csv": os.path.join(base, "triplets.csv"),
+        "bad_csv": os.path.join(base, "bad_triplets.csv"),
+        "parquet_dir": os.path.join(base, "parquet"),
+    }
+
+
+# ======= Komande =======
+
+def work(args, method):
+    df = method.load_chunks()
+    owner = args.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    conn = connect(args.db)
+    done = 0
+    while True:
+        claimed = claim_shard(conn, owner, args.lease)
+        if claimed is None:
+            break
+        shard_id, qids = claimed
+        paths = shard_paths(args.shard_dir, shard_id)
+        os.makedirs(paths["dir"], exist_ok=True)
+
+        shard_df = df[df['question_ID'].isin(qids)].reset_index(drop=True)
+        print(f"🧩 [{owner}] shard {shard_id}: {len(qids)} question(s), {len(shard_df)} chunk(s)")
+
+        keeper = LeaseKeeper(args.db, shard_id, owner, args.lease)
+        keeper.start()
+        try:
+            method.run(shard_df, output_csv=paths["output_csv"], bad_csv=paths["bad_csv"],
+                       parquet_dir=paths["parquet_dir"], start_chunk_id=0,
+                       should_stop=lambda: keeper.lost or not keeper.is_alive())
+        finally:
+            keeper.stop()
+            keeper.join()
+
+        if keeper.lost:
+            print(f"⚠️ [{owner}] lost lease on shard {shard_id}; leaving it to the new owner.")
+        elif complete_shard(conn, shard_id, owner):
+            done += 1
+            print(f"✅ [{owner}] shard {shard_id} done.")
+    conn.close()
+    print(f"[{owner}] no more shards ({done} completed by this worker).")
+
+
+def status(args):
+    conn = connect(args.db)
+    rows = conn.execute("SELECT status, COUNT(*), SUM(n_chunks) FROM shards GROUP BY status").fetchall()
+    expired = conn.execute("SELECT COUNT(*) FROM shards WHERE status = 'leased' AND lease_expires < ?",
+                           (time.time(),)).fetchone()[0]
+    conn.close()
+    for st, n, chunks in rows:
+        print(f"{st:<8} {n:>6} shard(s) {chunks or 0:>10} chunk(s)")
+    if expired:
+        print(f"{expired} leased shard(s) with expired lease (will be re-claimed)")
+
+
+def _sorted_rows(rows, key, source: str):
+    """Prolazi redove jednog sharda i upozori ako nisu rastući po chunk_ID (npr. ponovljen chunk)."""
+    last = None
+    for row in rows:
+        k = key(row)
+        if last is not None and k < last:
+            print(f"⚠️ {source} is not in chunk_ID order ({k} after {last}); "
+                  f"the merged output will not be fully sorted.")
+            yield row
+            yield from rows
+            return
+        last = k
+        yield row
+
+
+def _csv_key(row) -> int:
+    return int(float(row[0]))
+
+
+def _merge_csv(paths: list, out_path: str) -> int:
+    """
+    Spoji pipe-delimited CSV-ove istog zaglavlja po chunk_ID. Svaki shard je već
+    poredan (shard_df je sortiran i piše se redom), pa je ovo k-way merge u
+    jednom prolazu: u memoriji je po jedan red iz svakog sharda.
+    """
+    with ExitStack() as stack:
+        header, readers = None, []
+        for p in paths:
+            if not os.path.isfile(p):
+                continue
+            reader = csv.reader(stack.enter_context(open(p, encoding="utf-8", newline="")), delimiter='|')
+            h = next(reader, None)
+            if h is None:
+                continue
+            header = header or h
+            readers.append(_sorted_rows(reader, _csv_key, p))
+        if header is None:
+            return 0
+        n = 0
+        with open(out_path, "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f, delimiter='|', quoting=csv.QUOTE_MINIMAL)
+            w.writerow(header)
+            for row in heapq.merge(*readers, key=_csv_key):
+                w.writerow(row)
+                n += 1
+    return n
+
+
+def _parquet_parts(d: str) -> list:
+    if not os.path.isdir(d):
+        return []
+    return [os.path.join(d, f) for f in sorted(os.listdir(d)) if f.endswith(".parquet")]
+
+
+def _parquet_rows(parts: list):
+    import pyarrow.parquet as pq
+
+    for path in parts:  # part-<time_ns>-... : imena su hronološka
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=10_000):
+            yield from batch.to_pylist()
+
+
+def _merge_parquet(dirs: list, out_dir: str, batch_rows: int = 50_000) -> int:
+    """Isti k-way merge za Parquet; izlaz je jedan fajl sa row group-ama od batch_rows redova."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    shards = [parts for parts in (_parquet_parts(d) for d in dirs) if parts]
+    if not shards:
+        return 0
+    schema = pq.read_schema(shards[0][0])
+    os.makedirs(out_dir, exist_ok=True)
+    name = "part-merged.parquet"
+    tmp = os.path.join(out_dir, "." + name + ".tmp")
+    key = lambda r: r["chunk_ID"]
+    n, buf = 0, []
+    with pq.ParquetWriter(tmp, schema, compression="zstd") as writer:
+        for row in heapq.merge(*(_sorted_rows(_parquet_rows(parts), key, os.path.dirname(parts[0]))
+                                 for parts in shards), key=key):
+            buf.append(row)
+            if len(buf) >= batch_rows:
+                writer.write_table(pa.Table.from_pylist(buf, schema=schema))
+                n, buf = n + len(buf), []
+        if buf:
+            writer.write_table(pa.Table.from_pylist(buf, schema=schema))
+            n += len(buf)
+    os.replace(tmp, os.path.join(out_dir, name))
+    # stari partovi (--force) se brišu tek kad je novi fajl kompletan
+    for old in _parquet_parts(out_dir):
+        if os.path.basename(old) != name:
+            os.remove(old)
+    return n
+
+
+def merge(args, method):
+    from triplet_writer import journal_path
+
+    conn = connect(args.db)
+    shard_ids = [r[0] for r in conn.execute("SELECT shard_id FROM shards ORDER BY shard_id")]
+    pending = conn.execute("SELECT COUNT(*) FROM shards WHERE status != 'done'").fetchone()[0]
+    conn.close()
+    if pending and not args.force:
+        raise SystemExit(f"⚠️ {pending} shard(s) not done yet (use --force to merge anyway).")
+
+    use_csv = method.OUTPUT_FORMAT in ("csv", "both")
+    use_parquet = method.OUTPUT_FORMAT in ("parquet", "both")
+    targets = [t for t in (method.OUTPUT_CSV, method.BAD_CSV) if use_csv and os.path.exists(t)]
+    if use_parquet:
+        targets += [d for d in (os.path.join(method.PARQUET_DIR, k) for k in ("good", "bad"))
+                    if _parquet_parts(d)]
+    if targets and not args.force:
+        raise SystemExit(f"⚠️ {targets} already exist; refusing to overwrite (use --force).")
+
+    paths = [shard_paths(args.shard_dir, i) for i in shard_ids]
+    if use_csv:
+        os.makedirs(os.path.dirname(method.BAD_CSV) or ".", exist_ok=True)
+        n_good = _merge_csv([p["output_csv"] for p in paths], method.OUTPUT_CSV)
+        n_bad = _merge_csv([p["bad_csv"] for p in paths], method.BAD_CSV)
+        print(f"Merged {n_good} good / {n_bad} bad row(s) into {method.OUTPUT_CSV}, {method.BAD_CSV}")
+    if use_parquet:
+        for kind in ("good", "bad"):
+            n = _merge_parquet([os.path.join(p["parquet_dir"], kind) for p in paths],
+                               os.path.join(method.PARQUET_DIR, kind))
+            print(f"Merged {n} {kind} row(s) into {method.PARQUET_DIR}/{kind}")
+    # journal starog izlaza ne važi za spojeni (sljedeći run ga pravi iz spojenog izlaza)
+    journal = journal_path(method.OUTPUT_CSV)
+    if os.path.isfile(journal):
+        os.remove(journal)
+        print(f"📒 Removed stale {journal}; the next run seeds it from the merged output.")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Shardovana obrada chunkova preko SQLite reda sa lease-om.")
+    ap.add_argument("command", choices=["init", "work", "status", "merge"])
+    ap.add_argument("--method", default="SecondMethod",
+                    choices=["FirstMethod", "SecondMethod", "ThirdMethod"])
+    ap.add_argument("--db", default=None, help="SQLite red (default shards_<method>.sqlite).")
+    ap.add_argument("--shard-dir", default=None, help="Folder za izlaze shardova (default shards_<method>).")
+    ap.add_argument("--shards", type=int, default=8, help="Broj shardova za init.")
+    ap.add_argument("--lease", type=float, default=DEFAULT_LEASE_S,
+                    help="Trajanje lease-a u sekundama (obnavlja se dok worker radi).")
+    ap.add_argument("--worker-id", default=None, help="Ime workera (default host-pid).")
+    ap.add_argument("--force", action="store_true", help="merge: dozvoli nedovršene shardove / prepisivanje.")
+    args = ap.parse_args()
+
+    args.db = args.db or f"shards_{args.method}.sqlite"
+    args.shard_dir = args.shard_dir or f"shards_{args.method}"
+
+    if args.command == "status":
+        status(args)
+        return
+
+    method = load_method(args.method)
+    if args.command == "init":
+        conn = connect(args.db)
+        init_queue(conn, method.load_chunks(), args.shards)
+        conn.close()
+        print(f"Initialized {args.db}")
+        status(args)
+    elif args.command == "work":
+        work(args, method)
+    else:
+        merge(args, method)
+
+
+if __name__ == "__main__":
+    main()